@@ -0,0 +1,83 @@
+"""
+Compare output zip export throughput: deflate everything vs. store already compressed images.
+
+Builds a synthetic outputs tree (random bytes stand in for PNG/JPEG data since
+they are just as incompressible, plus json/txt metadata) and streams it through
+workers.zipOutputs.stream_output_zip with both policies.
+
+usage: python benchmarks/zip_export.py [--images 200] [--image-mb 4] [--level 6]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workers.zipOutputs import stream_output_zip  # noqa: E402
+
+
+def build_outputs_tree(root, images, image_mb):
+    """Create txt2img/img2img date folders with images and their generation metadata"""
+    total = 0
+    for i in range(images):
+        folder = "txt2img-images" if i % 2 == 0 else "img2img-images"
+        day = f"2024-01-{(i % 28) + 1:02d}"
+        target = os.path.join(root, folder, day)
+        os.makedirs(target, exist_ok=True)
+
+        ext = (".png", ".jpg", ".webp")[i % 3]
+        image_path = os.path.join(target, f"{i:05d}{ext}")
+        with open(image_path, "wb") as f:
+            f.write(os.urandom(int(image_mb * 1024 * 1024)))
+
+        meta_path = os.path.join(target, f"{i:05d}.json")
+        with open(meta_path, "w") as f:
+            json.dump(
+                {
+                    "prompt": "a photo of a baby hippo, highly detailed " * 20,
+                    "steps": 30,
+                    "sampler": "Euler a",
+                    "seed": i,
+                },
+                f,
+            )
+        total += os.path.getsize(image_path) + os.path.getsize(meta_path)
+    return total
+
+
+async def export(root, level, store_compressed):
+    size = 0
+    start = time.perf_counter()
+    async for chunk in stream_output_zip(root, level, store_compressed):
+        size += len(chunk)
+    return time.perf_counter() - start, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--image-mb", type=float, default=4)
+    parser.add_argument("--level", type=int, default=6)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        total = build_outputs_tree(root, args.images, args.image_mb)
+        print(f"synthetic outputs: {args.images} images, {total / 1024 / 1024:.1f} MiB")
+
+        for label, store_compressed in (
+            ("deflate everything", False),
+            ("store images", True),
+        ):
+            elapsed, size = asyncio.run(export(root, args.level, store_compressed))
+            print(
+                f"{label:>20}: {elapsed:7.2f}s  {total / 1024 / 1024 / elapsed:8.1f} MiB/s"
+                f"  archive {size / 1024 / 1024:.1f} MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,57 @@
 import concurrent.futures
+import os
 import threading
+from collections import deque
+from itertools import islice
 
-# log buffer aka. like queue first in first out and threding lock to prevent race condition.
-log_buffer = []
-log_lock = threading.Lock()
+# how many log lines are kept in memory for /logs and the index page
+LOG_BUFFER_SIZE = int(os.getenv("LOG_BUFFER_SIZE", "500"))
+
+
+class LogRingBuffer:
+    """
+    Fixed capacity ring buffer for the in-memory log tail.
+
+    Every appended item gets a monotonically increasing sequence number, old items
+    fall off the front in O(1). The lock is only held to append or to copy a
+    snapshot, formatting happens on the copy outside the lock.
+    """
+
+    def __init__(self, capacity=LOG_BUFFER_SIZE):
+        self.capacity = capacity
+        self._items = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.last_seq = 0
+
+    def append(self, item):
+        """Append an item and return its sequence number"""
+        with self._lock:
+            self.last_seq += 1
+            self._items.append((self.last_seq, item))
+            return self.last_seq
+
+    def snapshot(self, since=None):
+        """
+        Return a consistent copy of [(seq, item), ...], only items after `since` when given
+        """
+        with self._lock:
+            if since is None or not self._items:
+                return list(self._items)
+            first_seq = self._items[0][0]
+            skip = max(0, since - first_seq + 1)
+            return list(islice(self._items, skip, None))
+
+    @property
+    def first_seq(self):
+        with self._lock:
+            return self._items[0][0] if self._items else self.last_seq + 1
+
+    def __len__(self):
+        return len(self._items)
+
+
+# log buffer of parsed LogRecord aka. like queue first in first out, the ring buffer does its own locking.
+log_buffer = LogRingBuffer()
 
 # idk why have this
 thread_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4)
@@ -0,0 +1,240 @@
+import math
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+MIB = 1024 * 1024
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DURATION_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+SIZE_BUCKETS = tuple(MIB * 4**n for n in range(9))  # 1 MiB .. 64 GiB
+THROUGHPUT_BUCKETS = tuple(MIB * 2**n for n in range(11))  # 1 MiB/s .. 1 GiB/s
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        yield name + "_total", labels, self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from `function` at scrape time instead"""
+        self.function = function
+
+    def samples(self, name, labels):
+        yield name, labels, self.function() if self.function else self.value
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else repr(float(bound))
+            yield name + "_bucket", labels + (("le", le),), cumulative
+        yield name + "_sum", labels, self.sum
+        yield name + "_count", labels, self.count
+
+
+class MetricFamily:
+    """
+    One metric with its labelled children.
+
+    Values are plain attributes updated in place, nothing is allocated on
+    the hot paths (look children up once with `labels` and keep them). The
+    writers are single threads/the event loop, a scrape may read a value
+    that is one update behind.
+    """
+
+    def __init__(self, kind, name, help, labelnames=(), **options):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.options = options
+        self._children: Dict[Tuple, object] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if self.kind == "counter":
+                child = Counter()
+            elif self.kind == "gauge":
+                child = Gauge()
+            else:
+                child = Histogram(self.options["buckets"])
+            self._children[values] = child
+        return child
+
+    # unlabelled metrics are used directly
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+    def set_function(self, function):
+        self._default.set_function(function)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def render(self, out: List[str]):
+        out.append(f"# HELP {self.name} {self.help}")
+        out.append(f"# TYPE {self.name} {self.kind}")
+        for values, child in list(self._children.items()):
+            labels = tuple(zip(self.labelnames, values))
+            for name, sample_labels, value in child.samples(self.name, labels):
+                if sample_labels:
+                    text = ",".join(f'{k}="{_escape(v)}"' for k, v in sample_labels)
+                    name = f"{name}{{{text}}}"
+                out.append(f"{name} {value}")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[MetricFamily] = []
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(MetricFamily("counter", name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(MetricFamily("gauge", name, help, labelnames))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS, labelnames=()):
+        return self._add(
+            MetricFamily("histogram", name, help, labelnames, buckets=tuple(buckets))
+        )
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        out = []
+        for metric in self._metrics:
+            metric.render(out)
+        return "\n".join(out) + "\n"
+
+
+registry = MetricsRegistry()
+
+# log tail (workers/tailLogsFile.py), rate(forge_log_lines_read_total) is the lines/s
+log_lines_read = registry.counter(
+    "forge_log_lines_read", "Log lines read from forge.log"
+)
+log_tail_lag_seconds = registry.gauge(
+    "forge_log_tail_lag_seconds",
+    "Seconds between the last write to forge.log and the tail reading it",
+)
+log_tail_lag_bytes = registry.gauge(
+    "forge_log_tail_lag_bytes", "Bytes of forge.log not read yet by the tail"
+)
+
+# websocket broadcast (constants/websocketEventManager.py)
+ws_clients = registry.gauge("forge_ws_clients", "Connected websocket clients")
+ws_broadcast_latency = registry.histogram(
+    "forge_ws_broadcast_latency_seconds",
+    "Time from publishing a message to handing it to the clients",
+)
+ws_fanout_seconds = registry.histogram(
+    "forge_ws_fanout_seconds", "Time to queue one frame for every client"
+)
+ws_frames_sent = registry.counter("forge_ws_frames_sent", "Frames sent to clients")
+ws_frames_dropped = registry.counter(
+    "forge_ws_frames_dropped", "Frames dropped by the slow client policy"
+)
+
+# http
+logs_render_seconds = registry.histogram(
+    "forge_logs_render_seconds", "Time to render /logs", labelnames=("format",)
+)
+zip_export_seconds = registry.histogram(
+    "forge_zip_export_seconds",
+    "Duration of /download/outputs exports",
+    buckets=DURATION_BUCKETS,
+)
+zip_export_bytes = registry.histogram(
+    "forge_zip_export_bytes",
+    "Size of /download/outputs exports",
+    buckets=SIZE_BUCKETS,
+)
+
+# download jobs (workers/downloadJobManager.py)
+downloads_finished = registry.counter(
+    "forge_downloads_finished",
+    "Finished download jobs",
+    labelnames=("source", "status"),
+)
+download_bytes = registry.histogram(
+    "forge_download_bytes",
+    "Size of completed downloads",
+    buckets=SIZE_BUCKETS,
+    labelnames=("source",),
+)
+download_throughput = registry.histogram(
+    "forge_download_throughput_bytes_per_second",
+    "Average speed of completed downloads",
+    buckets=THROUGHPUT_BUCKETS,
+    labelnames=("source",),
+)
+download_duration = registry.histogram(
+    "forge_download_duration_seconds",
+    "Duration of completed downloads",
+    buckets=DURATION_BUCKETS,
+    labelnames=("source",),
+)
+
+# event loop
+loop_lag_seconds = registry.gauge(
+    "forge_event_loop_last_lag_seconds", "Last measured event loop scheduling delay"
+)
+loop_lag = registry.histogram(
+    "forge_event_loop_lag_seconds", "Event loop scheduling delay"
+)
+loop_blocked = registry.counter(
+    "forge_event_loop_blocked",
+    "Callbacks that held the event loop longer than the watchdog threshold",
+)
+loop_blocked_seconds = registry.histogram(
+    "forge_event_loop_blocked_seconds",
+    "How late the event loop woke up after a blocking callback",
+    buckets=(0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+process_start_time = registry.gauge(
+    "process_start_time_seconds", "Start time of the process since unix epoch"
+)
+process_start_time.set(time.time())
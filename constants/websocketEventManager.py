@@ -1,31 +1,311 @@
 import asyncio
 import json
-from typing import List
+import os
+import time
+from collections import deque
+from typing import List, Optional
 
-from websocket import WebSocket
+from starlette.websockets import WebSocket
+
+from constants.metrics import (
+    ws_broadcast_latency,
+    ws_clients,
+    ws_fanout_seconds,
+    ws_frames_dropped,
+    ws_frames_sent,
+)
+
+# a client that doesn't accept a frame within this time is dropped so it can't stall the others
+SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+
+# max frames waiting in a client's outbound queue before the slow client policy kicks in
+CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "256"))
+# "drop_oldest" drops the oldest queued frames and sends a "skipped N lines" marker, "disconnect" closes the client
+SLOW_CLIENT_POLICY = os.getenv("WS_SLOW_CLIENT_POLICY", "drop_oldest")
+
+# log lines arriving within this window are coalesced into one "new_log_lines" frame (0 disables batching)
+LOG_BATCH_INTERVAL = int(os.getenv("WS_LOG_BATCH_INTERVAL_MS", "50")) / 1000
+# a batch is flushed early once it holds this many lines
+LOG_BATCH_MAX_LINES = int(os.getenv("WS_LOG_BATCH_MAX_LINES", "200"))
+
+# marker used to tell log lines apart from regular messages inside the hub queue
+_LOG_LINE = object()
+
+
+class WebSocketClient:
+    """
+    One connected WebSocket with its own bounded outbound queue and writer task.
+
+    The hub only enqueues frames, so a client on a slow link never blocks the
+    others. When the queue is full the client's policy decides whether the oldest
+    frames are dropped (and a "log_skipped" marker is sent later) or the client is
+    disconnected.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        hub: "BroadcastHub",
+        max_queue: int = CLIENT_QUEUE_SIZE,
+        policy: str = SLOW_CLIENT_POLICY,
+    ):
+        self.websocket = websocket
+        self.hub = hub
+        self.max_queue = max_queue
+        self.policy = policy
+        self.connected_at = time.time()
+        self.sent_frames = 0
+        self.dropped_frames = 0
+        self.dropped_lines = 0
+        self._queue = deque()
+        self._skipped_lines = 0
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task = asyncio.get_running_loop().create_task(self._writer())
+
+    def enqueue(self, frame: str, lines: int = 0):
+        """Queue a serialized frame, applying the slow client policy when full"""
+        if self._closing:
+            return
+
+        if len(self._queue) >= self.max_queue:
+            ws_frames_dropped.inc()
+            if self.policy == "disconnect":
+                self.dropped_frames += 1
+                self.dropped_lines += lines
+                self._closing = True
+                self._wakeup.set()
+                return
+
+            _, old_lines = self._queue.popleft()
+            self.dropped_frames += 1
+            self.dropped_lines += old_lines
+            self._skipped_lines += old_lines
+
+        self._queue.append((frame, lines))
+        self._wakeup.set()
+
+    async def _writer(self):
+        try:
+            while True:
+                if self._closing:
+                    # too slow for the disconnect policy, 1013 = try again later
+                    await self.websocket.close(code=1013)
+                    break
+
+                if not self._queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+
+                if self._skipped_lines:
+                    marker = json.dumps(
+                        {"type": "log_skipped", "count": self._skipped_lines}
+                    )
+                    self._skipped_lines = 0
+                    await asyncio.wait_for(
+                        self.websocket.send_text(marker), SEND_TIMEOUT
+                    )
+
+                frame, _ = self._queue.popleft()
+                await asyncio.wait_for(self.websocket.send_text(frame), SEND_TIMEOUT)
+                self.sent_frames += 1
+                ws_frames_sent.inc()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        # Remove disconnected (or too slow) clients
+        self.hub.unregister(self)
+
+    def close(self):
+        self._closing = True
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    def stats(self):
+        client = self.websocket.client
+        return {
+            "client": f"{client.host}:{client.port}" if client else None,
+            "connected_at": self.connected_at,
+            "policy": self.policy,
+            "queued_frames": len(self._queue),
+            "sent_frames": self.sent_frames,
+            "dropped_frames": self.dropped_frames,
+            "dropped_lines": self.dropped_lines,
+        }
+
+
+class BroadcastHub:
+    """
+    Fan out messages to every connected WebSocket client.
+
+    The hub lives on the server's event loop. Other threads (the log tail thread)
+    hand messages over with `publish`, which goes through `call_soon_threadsafe`
+    into an asyncio queue drained by a single pump task on that loop. Each frame
+    is then handed to the per-client queues (see WebSocketClient).
+
+    Log lines are batched: the pump waits up to LOG_BATCH_INTERVAL (or until
+    LOG_BATCH_MAX_LINES are pending) and sends them as one frame, serialized once
+    and shared by every client.
+    """
+
+    def __init__(self):
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connections: List[WebSocketClient] = []
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._pending_lines = 0
+        self._batch_full: Optional[asyncio.Event] = None
+        # loop time the oldest item still in the queue was published, for the latency metric
+        self._oldest_queued: Optional[float] = None
+
+    def start(self):
+        """Bind the hub to the running loop and start the pump task"""
+        self.loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._batch_full = asyncio.Event()
+        self._task = self.loop.create_task(self._pump())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        self.loop = None
+
+        for client in list(self.connections):
+            client.close()
+        self.connections.clear()
+
+    def register(self, websocket: WebSocket) -> WebSocketClient:
+        client = WebSocketClient(websocket, self)
+        self.connections.append(client)
+        return client
+
+    def unregister(self, client: WebSocketClient):
+        if client in self.connections:
+            self.connections.remove(client)
+        client.close()
+
+    def publish(self, message: dict):
+        """Queue a message from any thread, dropped when the hub isn't running yet"""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._put, message)
+
+    def publish_nowait(self, message: dict):
+        """Queue a message from code already running on the hub's loop"""
+        if self._queue is not None and self.loop is not None:
+            self._put(message)
+
+    def _put(self, item):
+        if self._oldest_queued is None:
+            self._oldest_queued = self.loop.time()
+        self._queue.put_nowait(item)
+
+    def publish_log_line(self, line: str, seq: int = 0):
+        """Queue an already formatted log line (with its log buffer sequence number) from any thread"""
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._put_log_line, line, seq)
+
+    def _put_log_line(self, line: str, seq: int):
+        self._put((_LOG_LINE, line, seq))
+        self._pending_lines += 1
+        if self._pending_lines >= LOG_BATCH_MAX_LINES:
+            self._batch_full.set()
+
+    async def _pump(self):
+        while True:
+            item = await self._queue.get()
+
+            if isinstance(item, tuple) and item[0] is _LOG_LINE and LOG_BATCH_INTERVAL:
+                # give the batch window a chance to fill up before flushing
+                if self._pending_lines < LOG_BATCH_MAX_LINES:
+                    try:
+                        await asyncio.wait_for(
+                            self._batch_full.wait(), LOG_BATCH_INTERVAL
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+
+            items = [item]
+            while not self._queue.empty():
+                items.append(self._queue.get_nowait())
+            queued_at, self._oldest_queued = self._oldest_queued, None
+
+            try:
+                for frame, lines in self._frames(items):
+                    started = time.perf_counter()
+                    self._fan_out(frame, lines)
+                    ws_fanout_seconds.observe(time.perf_counter() - started)
+                if queued_at is not None:
+                    ws_broadcast_latency.observe(self.loop.time() - queued_at)
+            except Exception as e:
+                print(f"Error broadcasting to websockets: {e}")
+
+    def _frames(self, items):
+        """
+        Turn queued items into (serialized frame, line count) pairs, grouping consecutive log lines
+        """
+        lines = []
+        seq = 0
+        for item in items:
+            if isinstance(item, tuple) and item[0] is _LOG_LINE:
+                self._pending_lines -= 1
+                _, line, seq = item
+                if not LOG_BATCH_INTERVAL:
+                    frame = {"type": "new_log_line", "line": line, "seq": seq}
+                    yield json.dumps(frame), 1
+                    continue
+                lines.append(line)
+                if len(lines) >= LOG_BATCH_MAX_LINES:
+                    yield _log_lines_frame(lines, seq), len(lines)
+                    lines = []
+            else:
+                if lines:
+                    yield _log_lines_frame(lines, seq), len(lines)
+                    lines = []
+                yield json.dumps(item), 0
+
+        if lines:
+            yield _log_lines_frame(lines, seq), len(lines)
+        self._batch_full.clear()
+
+    def _fan_out(self, text: str, lines: int = 0):
+        """Hand one serialized frame to every client's outbound queue"""
+        for client in list(self.connections):
+            client.enqueue(text, lines)
+
+
+def _log_lines_frame(lines, seq):
+    """Serialize a batch of log lines, `seq` is the sequence number of the last one"""
+    return json.dumps({"type": "new_log_lines", "lines": lines, "seq": seq})
+
+
+hub = BroadcastHub()
+ws_clients.set_function(lambda: len(hub.connections))
+
+# list of connected websocket clients
+websocket_connections: List[WebSocketClient] = hub.connections
 
-# list of websockets instance
-websocket_connections: List[WebSocket] = []
 
 # send msg to websockets client (async)
 async def broadcast_to_websockets(message: dict):
     """Send a message to all connected WebSocket clients"""
-    if websocket_connections:
-        disconnected = []
-        for websocket in websocket_connections:
-            try:
-                await websocket.send_text(json.dumps(message))
-            except:
-                disconnected.append(websocket)
+    hub.publish_nowait(message)
 
-        # Remove disconnected clients
-        for ws in disconnected:
-            websocket_connections.remove(ws)
 
 # send msg to websocksts client (sync way)
 def sync_broadcast_to_websockets(message: dict):
-    """Synchronous wrapper for broadcasting to websockets from non-async context"""
+    """Thread-safe way of broadcasting to websockets from non-async context"""
     try:
-        asyncio.run(broadcast_to_websockets(message))
+        hub.publish(message)
     except Exception as e:
         print(f"Error broadcasting to websockets: {e}")
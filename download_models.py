@@ -1,11 +1,25 @@
 import os
 import json
+import time
 import asyncio
-import aiohttp
 from pathlib import Path
 import logging
 import sys
-from typing import List, Dict, Any
+from typing import List
+
+from workers.aria2Daemon import aria2
+from workers.diskSpace import DiskSpaceError, disk_space
+from workers.downloadPlanner import PlannedDownload, plan_downloads, run_plan
+from utils.modelsConfig import CATEGORY_TO_PATH, get_config_async
+from utils.safetensorsHeader import check_safetensors
+from workers.modelResolver import (
+    detect_source,
+    model_resolver,
+    url_filename,
+    with_query,
+)
+from workers.modelStore import ModelStore, ModelStoreError
+from workers.rangeDownloader import download_with_ranges
 
 # Prevent duplicate logging
 logging.getLogger().handlers = []
@@ -28,92 +42,152 @@ stdout_handler.setFormatter(
 )
 logger.addHandler(stdout_handler)
 
-# Global semaphore to limit concurrent downloads
-download_semaphore = asyncio.Semaphore(3)
+# Downloads running at the same time, the plan decides the order
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MODEL_DOWNLOAD_CONCURRENCY", "3"))
+
+# categories Forge needs to boot, downloaded first; Forge starts once they're done
+CRITICAL_CATEGORIES = [
+    category.strip()
+    for category in os.getenv(
+        "CRITICAL_MODEL_CATEGORIES", "Stable-diffusion,VAE,text_encoder"
+    ).split(",")
+    if category.strip()
+]
+# written when the critical models are done, start.sh waits for it before starting Forge
+READY_MARKER = os.getenv(
+    "MODELS_READY_MARKER", os.path.join("/workspace", ".forge_downloads", "critical.ready")
+)
+
+# how often the progress of a running download is written to the log
+PROGRESS_LOG_INTERVAL = 30
+
+# "aria2" (shared daemon) or "native" (asyncio range downloader)
+DOWNLOAD_ENGINE = os.getenv("DOWNLOAD_ENGINE", "aria2")
+
+# verified models, hardlinked into the category folders
+model_store = ModelStore()
+
+# token for civitai models that need a login (joined to the download urls)
+CIVITAI_API_KEY = os.getenv("CIVITAI_API_KEY") or None
 
-# Model category to Forge folder mapping
-CATEGORY_TO_PATH = {
-    "Stable-diffusion": "models/Stable-diffusion",
-    "VAE": "models/VAE",
-    "Lora": "models/Lora",
-    "ESRGAN": "models/ESRGAN",
-    "ControlNet": "models/ControlNet",
-    "text_encoder": "models/text_encoder",
-}
 
 async def download_file(
-    url: str, output_path: Path, semaphore: asyncio.Semaphore
+    url: str, output_path: Path, filename: str, segments: int = 4
 ) -> bool:
-    """Download a file using aria2c with optimized settings for faster downloads (async)"""
-    async with semaphore:
-        filename = url.split("/")[-1]
-        logger.info(f"Starting download of {filename} from {url}")
-
-        cmd = [
-            "aria2c",
-            "--console-log-level=warn",  # Reduce verbosity to warnings only
-            "-c",  # Continue downloading if partial file exists
-            "-x",
-            "4",  # Increase concurrent connections to 4
-            "-s",
-            "4",  # Split file into 4 parts
-            "-k",
-            "1M",  # Minimum split size
-            "--file-allocation=none",  # Disable file allocation for faster start
-            "--optimize-concurrent-downloads=true",  # Optimize concurrent downloads
-            "--max-connection-per-server=16",  # Maximum connections per server
-            "--min-split-size=1M",  # Minimum split size
-            "--max-tries=5",  # Maximum retries
-            "--retry-wait=10",  # Wait between retries
-            "--connect-timeout=30",  # Connection timeout
-            "--timeout=600",  # Timeout for stalled downloads
-            "--summary-interval=30",  # Show summary every 30 seconds
-            url,
-            "-d",
-            str(output_path),
-            "-o",
-            filename,  # Specify output filename
-        ]
+    """Download a file through the shared aria2c daemon or the native engine (async)"""
+    logger.info(f"Starting download of {filename} from {url} ({segments} connections)")
 
-        try:
-            logger.info(f"Running download command for {filename}")
-            # Use async subprocess for non-blocking execution
-            process = await asyncio.create_subprocess_exec(
-                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    last_logged = time.monotonic()
+
+    def log_progress(progress):
+        # Show summary every 30 seconds
+        nonlocal last_logged
+        if time.monotonic() - last_logged < PROGRESS_LOG_INTERVAL:
+            return
+        last_logged = time.monotonic()
+        percent = progress["percent"] if progress["percent"] is not None else "?"
+        logger.info(
+            f"{filename}: {percent}% at {progress['speed_bytes'] / 1024 / 1024:.1f} MiB/s"
+        )
+
+    try:
+        if DOWNLOAD_ENGINE == "native":
+            await download_with_ranges(
+                url,
+                output_path,
+                filename,
+                segments=segments,
+                on_progress=log_progress,
             )
+        else:
+            logger.info(f"Queuing {filename} on the aria2c daemon")
+            await aria2.download(
+                url,
+                output_path,
+                filename=filename,
+                options={
+                    "split": segments,  # sized by the planner from the file size
+                    "max-connection-per-server": segments,
+                    "min-split-size": "1M",  # Minimum split size
+                },
+                on_progress=log_progress,
+            )
+        logger.info(f"Successfully downloaded {filename}")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to download {filename}: {e}")
+        return False
 
-            stdout, stderr = await process.communicate()
 
-            if process.returncode == 0:
-                logger.info(f"Successfully downloaded {filename}")
+def _check_structure(path: Path):
+    """Cheap safetensors header check, fails before the file is hashed (or loaded)"""
+    if path.suffix == ".safetensors":
+        error = check_safetensors(path)
+        if error:
+            raise ModelStoreError(f"{path.name} is corrupted: {error}")
+
+
+async def install_model(
+    item: PlannedDownload, force_download: bool
+) -> bool:
+    """Download a model if needed, verify its hash and add it to the model store"""
+    url = item.url
+    filename = item.filename
+    category_path = Path(item.directory)
+    target_path = category_path / filename
+    expected_sha256 = item.sha256
+
+    # a leftover .aria2/.part means an interrupted download, let it resume
+    partial = any(
+        Path(f"{target_path}{suffix}").exists() for suffix in (".aria2", ".part")
+    )
+    if target_path.exists() and not partial:
+        if not force_download:
+            # installed before the model store existed, or copied in by hand
+            logger.info(f"Verifying existing {filename}")
+            try:
+                _check_structure(target_path)
+                await model_store.add(target_path, url, expected_sha256)
+                logger.info(f"Skipping {filename}, file already exists and is verified")
                 return True
-            else:
-                error_msg = stderr.decode("utf-8") if stderr else stdout.decode()
-                logger.error(f"Failed to download {filename}: {error_msg}")
-                return False
-        except Exception as e:
-            logger.error(f"Unexpected error while downloading {url}: {e}")
-            return False
+            except ModelStoreError as e:
+                logger.warning(f"{e}, downloading it again")
+        # never write into the file in place, it may be a link to a stored object
+        target_path.unlink()
 
+    download_url = url
+    if CIVITAI_API_KEY and "civitai.com" in url:
+        download_url = with_query(url, token=CIVITAI_API_KEY)
 
-async def get_config_async(config_path: str) -> Dict[str, Any]:
-    """Load configuration from file or URL (async)"""
+    # fail now instead of on ENOSPC halfway through (aria2 doesn't preallocate)
     try:
-        # Check if it's a URL
-        if config_path.startswith(("http://", "https://")):
-            async with aiohttp.ClientSession() as session:
-                async with session.get(config_path) as response:
-                    response.raise_for_status()
-                    # Get text content and parse as JSON manually to handle GitHub's text/plain mimetype
-                    text_content = await response.text()
-                    return json.loads(text_content)
-        else:
-            # Load from local file
-            with open(config_path, "r") as f:
-                return json.load(f)
-    except Exception as e:
-        logger.error(f"Failed to load config from {config_path}: {e}")
-        return None
+        await disk_space.admit(
+            str(target_path),
+            str(target_path),
+            item.size,
+            on_wait=lambda message: logger.info(f"{filename}: {message}"),
+        )
+    except DiskSpaceError as e:
+        logger.error(str(e))
+        return False
+    try:
+        if not await download_file(
+            download_url, category_path, filename, item.segments
+        ):
+            return False
+    finally:
+        disk_space.release(str(target_path))
+
+    try:
+        _check_structure(target_path)
+        sha256 = await model_store.add(target_path, url, expected_sha256)
+    except ModelStoreError as e:
+        logger.error(str(e))
+        target_path.unlink(missing_ok=True)
+        return False
+    verified = "verified" if expected_sha256 else "no published hash"
+    logger.info(f"Stored {filename} (sha256 {sha256[:12]}, {verified})")
+    return True
 
 
 # Only create Forge-relevant directories
@@ -133,10 +207,10 @@ def ensure_directories(base_path: Path) -> None:
         logger.info(f"Ensured directory exists: {full_path}")
 
 
-async def download_category_models(
+async def collect_category_models(
     category: str, urls: List[str], base_path: Path, force_download: bool = False
-):
-    """Download all models in a category concurrently"""
+) -> List[PlannedDownload]:
+    """Return the models of a category that still have to be downloaded"""
     if not isinstance(urls, list):
         logger.warning(f"Skipping '{category}' as it's not a list of URLs")
         return []
@@ -148,31 +222,72 @@ async def download_category_models(
     category_path = base_path / CATEGORY_TO_PATH[category]
     category_path.mkdir(parents=True, exist_ok=True)
 
-    # Prepare download tasks
-    download_tasks = []
-    for url in urls:
-        filename = url.split("/")[-1]
-        if (category_path / filename).exists() and not force_download:
-            logger.info(f"Skipping {filename}, file already exists")
-            continue
-        logger.info(f"Queuing download: {filename} to {category_path}")
-        task = download_file(url, category_path, download_semaphore)
-        download_tasks.append((task, filename))
-    if not download_tasks:
-        logger.info(f"No new models to download in category: {category}")
-        return []
-    logger.info(
-        f"Starting {len(download_tasks)} concurrent downloads for category: {category}"
+    # file name, size and published hash from the source (cached between runs)
+    resolved = await asyncio.gather(
+        *(
+            # the civitai key only goes to civitai
+            model_resolver.resolve(
+                url, CIVITAI_API_KEY if detect_source(url) == "civitai" else None
+            )
+            for url in urls
+        )
     )
-    tasks = []
-    for i, (task, filename) in enumerate(download_tasks):
-        t = asyncio.create_task(
-            track_download_progress(
-                task, filename, i + 1, len(download_tasks), category
+
+    items = []
+    for model in resolved:
+        # civitai model pages resolve to the download url of their version
+        url = model.url
+        filename = model.filename or url_filename(url)
+        target_path = category_path / filename
+        if not force_download:
+            if model_store.installed(url, target_path):
+                logger.info(f"Skipping {filename}, already installed and verified")
+                continue
+            if model_store.link_from_store(url, target_path):
+                logger.info(f"Linked {filename} from the model store")
+                continue
+        items.append(
+            PlannedDownload(
+                url=url,
+                directory=str(category_path),
+                filename=filename,
+                critical=category in CRITICAL_CATEGORIES,
+                size=model.size,
+                sha256=model.sha256,
+                payload=category,
             )
         )
-        tasks.append(t)
-    return tasks
+    if not items:
+        logger.info(f"No new models to download in category: {category}")
+    return items
+
+
+def link_copies(item: PlannedDownload, copies: List[PlannedDownload]) -> None:
+    """Link a finished download into the other folders that list the same model"""
+    sha256 = model_store.urls.get(item.url)
+    for copy in copies:
+        copy_path = Path(copy.directory) / (copy.filename or item.filename)
+        copy_path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            linked = model_store.link_from_store(copy.url, copy_path, sha256)
+        except OSError as e:
+            logger.error(f"Could not link {copy_path.name} into {copy.payload}: {e}")
+            continue
+        if linked:
+            logger.info(f"Linked {copy_path.name} into {copy.payload}")
+        else:
+            logger.warning(
+                f"{copy_path.name} is not in the model store, not linked into {copy.payload}"
+            )
+
+
+def mark_critical_ready():
+    """Tell start.sh that Forge can start, the other downloads go on in the background"""
+    try:
+        os.makedirs(os.path.dirname(READY_MARKER), exist_ok=True)
+        Path(READY_MARKER).touch()
+    except OSError as e:
+        logger.warning(f"Could not write {READY_MARKER}: {e}")
 
 
 async def track_download_progress(
@@ -199,6 +314,8 @@ async def track_download_progress(
 
 async def main():
     """Main async function to download models concurrently"""
+    if os.path.exists(READY_MARKER):
+        os.remove(READY_MARKER)
     config_path = os.getenv("MODELS_CONFIG_URL", "/workspace/models_config.json")
     skip_download = os.getenv("SKIP_MODEL_DOWNLOAD", "").lower() == "true"
     force_download = os.getenv("FORCE_MODEL_DOWNLOAD", "").lower() == "true"
@@ -237,26 +354,81 @@ async def main():
         return
     total_models = sum(len(urls) for urls in config.values() if isinstance(urls, list))
     logger.info(f"Found {total_models} models in configuration")
-    logger.info(f"Maximum concurrent downloads: 5")
-    category_tasks = []
+    logger.info(f"Maximum concurrent downloads: {MAX_CONCURRENT_DOWNLOADS}")
+    items = []
     for category, urls in config.items():
         if isinstance(urls, list) and urls:
-            tasks = await download_category_models(category, urls, base_path, force_download)
-            [category_tasks.append(task) for task in tasks]
-    if category_tasks:
+            items.extend(
+                await collect_category_models(
+                    category, urls, base_path, force_download
+                )
+            )
+    if not items:
+        logger.info("No models to download.")
+        return
+
+    plan = await plan_downloads(items, MAX_CONCURRENT_DOWNLOADS)
+    for item, reason in plan.skipped:
+        logger.info(f"Skipping {item.filename} ({item.payload}), {reason}")
+    copies = {}
+    for item, source in plan.copies:
         logger.info(
-            f"Starting concurrent downloads for {len(category_tasks)} categories..."
+            f"{item.filename} ({item.payload}) is linked to the download "
+            f"for {source.payload} once it is done"
         )
-        await asyncio.gather(*category_tasks)
-        logger.info("All model downloads completed!")
-    else:
-        logger.info("No models to download.")
+        copies.setdefault(id(source), []).append(item)
+    logger.info(
+        f"Download plan: {len(plan.items)} files, {plan.total_bytes / 1024**3:.1f} GiB"
+    )
+    for i, item in enumerate(plan.items):
+        size = f"{item.size / 1024**2:.0f} MiB" if item.size else "unknown size"
+        critical = ", needed to start Forge" if item.critical else ""
+        logger.info(
+            f"  {i + 1}. {item.filename} ({item.payload}, {size}, "
+            f"{item.segments} connections{critical})"
+        )
+
+    critical_left = sum(1 for item in plan.items if item.critical)
+    if not critical_left:
+        mark_critical_ready()
+
+    async def run_item(item: PlannedDownload) -> bool:
+        nonlocal critical_left
+        result = await track_download_progress(
+            install_model(item, force_download),
+            item.filename,
+            plan.items.index(item) + 1,
+            len(plan.items),
+            item.payload,
+        )
+        if result:
+            link_copies(item, copies.get(id(item), []))
+        if item.critical:
+            critical_left -= 1
+            if critical_left == 0:
+                logger.info("Models needed to start Forge are ready")
+                mark_critical_ready()
+        return result
+
+    results = await run_plan(plan, run_item, MAX_CONCURRENT_DOWNLOADS)
+    logger.info(
+        f"All model downloads completed! ({sum(results)}/{len(results)} succeeded)"
+    )
+
+
+async def run():
+    try:
+        await main()
+    finally:
+        # also when nothing was downloaded or something failed, Forge must not wait forever
+        mark_critical_ready()
+        await aria2.close()
 
 
 if __name__ == "__main__":
     # Run the async main function
     try:
-        asyncio.run(main())
+        asyncio.run(run())
     except KeyboardInterrupt:
         logger.info("Download process interrupted by user")
     except Exception as e:
@@ -0,0 +1,16 @@
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+class BatchDownloadItem(BaseModel):
+    url: str
+    source: str
+    model_type: str = "loras"
+    filename: Optional[str] = None
+
+
+class BatchDownloadRequest(BaseModel):
+    items: List[BatchDownloadItem]
+    api_key: Optional[str] = None
+    engine: Optional[str] = None
@@ -8,3 +8,4 @@ class DownloadRequest(BaseModel):
     api_key: Optional[str] = None
     model_type: str = "loras"
     filename: Optional[str] = None
+    engine: Optional[str] = None
@@ -1,35 +1,101 @@
 import asyncio
-import io
+import hashlib
 import json
 import os
 import threading
-import zipfile
+import time
+import uuid
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import List, Optional
 
 import uvicorn
 from fastapi import (
-    BackgroundTasks,
     FastAPI,
     HTTPException,
+    Query,
     Request,
     WebSocket,
     WebSocketDisconnect,
 )
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
-from constants.websocketEventManager import websocket_connections
+from constants.logLock import log_buffer, thread_executor
+from constants.metrics import CONTENT_TYPE, logs_render_seconds, registry
+from constants.websocketEventManager import hub
+from dto.batchDownloadRequest import BatchDownloadRequest
 from dto.downloadRequest import DownloadRequest
-from utils.getCurrentLogs import get_current_logs
+from utils.getCurrentLogs import get_current_logs, get_logs_since
 from utils.getInstalledCustomNodes import get_installed_custom_nodes
 from utils.getInstalledModels import get_installed_models
+from workers.aria2Daemon import aria2
 from workers.download_file import (
-    download_from_civitai_async,
-    download_from_googledrive_async,
-    download_from_huggingface_async,
+    DOWNLOAD_ENGINES,
+    civitai_download_url,
+    model_dir_for,
+    prepare_download_job,
+    resolve_model_type,
+    run_download_job,
+)
+from workers.downloadPlanner import PlannedDownload, plan_downloads
+from workers.downloadJobManager import FINISHED_STATUSES, DownloadJobManager
+from workers.downloadProgress import progress_tracker
+from workers.diskSpace import disk_space
+from workers.modelInventory import model_inventory
+from workers.loopMonitor import loop_watchdog
+from workers.modelResolver import ResolvedModel, model_resolver, url_filename
+from workers.tailLogsFile import tail_log_file
+from workers.zipOutputs import (
+    build_manifest,
+    collect_output_files,
+    parse_since,
+    stream_output_zip,
+)
+
+# /logs render time by response format
+_logs_render_html = logs_render_seconds.labels("html")
+_logs_render_json = logs_render_seconds.labels("json")
+
+# queued model downloads (persisted, resumed on restart), admitted when they fit on disk
+download_jobs = DownloadJobManager(
+    run_download_job, prepare=prepare_download_job, disk_space=disk_space
 )
-from workers.tailLogsFile import tail_log_file, tlf_worker
+
+# url_type path param -> job source
+DOWNLOAD_SOURCES = ("civitai", "huggingface", "googledrive")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    start the websocket broadcast hub on the server loop, then the log tail thread feeding it
+    """
+    hub.start()
+    await download_jobs.start()
+    model_inventory.start()
+    loop_watchdog.start()
+
+    print("Starting log monitoring thread...")
+
+    # using thread to handle read logs like tail -f (always read latest log)
+    log_thread = threading.Thread(target=tail_log_file, daemon=True)
+    log_thread.start()
+
+    yield
+
+    loop_watchdog.stop()
+    await download_jobs.stop()
+    await aria2.close()
+    await hub.stop()
+
 
 # Initialize FastAPI with disable docs url (swagger and redoc)
 app = FastAPI(
@@ -37,6 +103,7 @@ app = FastAPI(
     description="Stable Diffusion WebUI Forge Runpod Log Viewer and Model Downloader",
     docs_url=None,
     redoc_url=None,
+    lifespan=lifespan,
 )
 
 # using static file to serve css,js and images
@@ -46,22 +113,6 @@ app.mount("/static", StaticFiles(directory="./static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
 
-def create_output_zip():
-    """Create a zip file of the Forge output directory"""
-    output_dir = os.path.join("/workspace", "stable-diffusion-webui-forge", "outputs")
-    memory_file = io.BytesIO()
-
-    with zipfile.ZipFile(memory_file, "w", zipfile.ZIP_DEFLATED) as zf:
-        for root, _, files in os.walk(output_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, output_dir)
-                zf.write(file_path, arcname)
-
-    memory_file.seek(0)
-    return memory_file
-
-
 # WebSocket endpoint for real-time log updates
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -69,97 +120,368 @@ async def websocket_endpoint(websocket: WebSocket):
     /ws endpoint for real time communication
     """
     await websocket.accept()
-    websocket_connections.append(websocket)
-    print(f"WebSocket connected. Total connections: {len(websocket_connections)}")
+    client = hub.register(websocket)
+    print(f"WebSocket connected. Total connections: {len(hub.connections)}")
 
     try:
         # Send initial logs
-        await websocket.send_text(
-            json.dumps({"type": "msg", "msg": "websocket connected"})
-        )
+        client.enqueue(json.dumps({"type": "msg", "msg": "websocket connected"}))
 
         # Keep the connection alive
         while True:
             await websocket.receive_text()
-    except WebSocketDisconnect:
-        websocket_connections.remove(websocket)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        hub.unregister(client)
         print(
-            f"WebSocket disconnected. Remaining connections: {len(websocket_connections)}"
+            f"WebSocket disconnected. Remaining connections: {len(hub.connections)}"
         )
 
 
+@app.get("/api/websockets")
+async def api_websockets():
+    """API endpoint to get per client websocket queue stats (dropped frames/lines)"""
+    return [client.stats() for client in hub.connections]
+
+
 @app.get("/api/custom-nodes")
 async def api_custom_nodes():
     """API endpoint to get installed custom nodes"""
-    return get_installed_custom_nodes()
+    # reads start.sh, keep the file io off the loop
+    return await asyncio.get_running_loop().run_in_executor(
+        thread_executor, get_installed_custom_nodes
+    )
+
+
+@app.get("/api/loop")
+async def api_loop():
+    """API endpoint to get the event loop lag and the stacks of callbacks that blocked it"""
+    return loop_watchdog.stats()
 
 
 @app.get("/api/models")
-async def api_models():
-    """API endpoint to get installed models"""
-    return get_installed_models()
+async def api_models(request: Request):
+    """API endpoint to get installed models, 304 while the inventory is unchanged"""
+    etag = model_inventory.etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    # may read safetensors headers of new files
+    models = await asyncio.get_running_loop().run_in_executor(
+        thread_executor, get_installed_models
+    )
+    return JSONResponse(models, headers={"ETag": etag})
 
 
 @app.get("/logs")
-async def get_logs():
-    return {"logs": get_current_logs()}
+async def get_logs(request: Request, since: Optional[int] = None):
+    """
+    without `since` return the whole buffer as html, with `since` only the lines after that
+    sequence number as json records. ETag is the last sequence number so an unchanged
+    buffer answers 304.
+    """
+    started = time.perf_counter()
+    if since is None:
+        lines = log_buffer.snapshot()
+        seq = lines[-1][0] if lines else log_buffer.last_seq
+        logs = get_current_logs(lines)
+        _logs_render_html.observe(time.perf_counter() - started)
+        return {"logs": logs, "seq": seq}
+
+    etag = f'W/"{log_buffer.last_seq}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    data = get_logs_since(since)
+    _logs_render_json.observe(time.perf_counter() - started)
+    return JSONResponse(data, headers={"ETag": f'W/"{data["seq"]}"'})
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of the log tail, websockets, downloads, exports and event loop"""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
+
+def _split_query_list(values):
+    """Accept both repeated query params and comma separated values"""
+    if not values:
+        return None
+    return [item.strip() for value in values for item in value.split(",") if item.strip()]
+
+
+async def _collect_outputs(since, subdir, glob):
+    """Resolve the export filters and walk the outputs folder in a worker thread"""
+    try:
+        since_ts = parse_since(since)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid since value: {since}")
+
+    subdirs = _split_query_list(subdir)
+    patterns = _split_query_list(glob)
+
+    # files modified while we walk are picked up by the next export
+    next_since = datetime.now().timestamp()
+    try:
+        files = await asyncio.get_running_loop().run_in_executor(
+            thread_executor,
+            lambda: collect_output_files(
+                since=since_ts, subdirs=subdirs, patterns=patterns
+            ),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filters = {"since": since_ts, "subdir": subdirs, "glob": patterns}
+    return files, build_manifest(files, next_since, filters)
+
+
+@app.get("/download/outputs/manifest")
+async def download_outputs_manifest(
+    since: Optional[str] = None,
+    subdir: Optional[List[str]] = Query(None),
+    glob: Optional[List[str]] = Query(None),
+):
+    """
+    list what /download/outputs would export with the same filters, without zipping anything.
+    """
+    _, manifest = await _collect_outputs(since, subdir, glob)
+    return manifest
 
 
 @app.get("/download/outputs")
-async def download_outputs():
+async def download_outputs(
+    since: Optional[str] = None,
+    subdir: Optional[List[str]] = Query(None),
+    glob: Optional[List[str]] = Query(None),
+):
     """
-    endpoint for download every outputs in zip file.
+    endpoint for download outputs in zip file, optionally only files newer than `since`
+    (unix timestamp or ISO date), inside `subdir` folders or matching `glob` patterns.
+    the archive ends with a manifest.json, its next_since (also in the X-Export-Next-Since
+    header) is the `since` to use for the next incremental download.
     """
+    files, manifest = await _collect_outputs(since, subdir, glob)
+
     try:
-        memory_file = create_output_zip()
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
+        # archive is built in a worker thread and streamed while it reads the outputs
         return StreamingResponse(
-            io.BytesIO(memory_file.read()),
+            stream_output_zip(files=files, manifest=manifest),
             media_type="application/zip",
             headers={
-                "Content-Disposition": f"attachment; filename=forge_outputs_{timestamp}.zip"
+                "Content-Disposition": f"attachment; filename=forge_outputs_{timestamp}.zip",
+                "X-Export-Files": str(manifest["total_files"]),
+                "X-Export-Bytes": str(manifest["total_bytes"]),
+                "X-Export-Next-Since": str(manifest["next_since"]),
             },
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/download/{url_type}", status_code=204)
-async def download(
-    request: DownloadRequest, url_type: str, background_tasks: BackgroundTasks
-):
+def _is_installed(item: PlannedDownload):
+    """Target exists and isn't a partial download"""
+    path = item.path
+    return bool(path) and os.path.exists(path) and not any(
+        os.path.exists(path + suffix) for suffix in (".aria2", ".part")
+    )
+
+
+@app.post("/api/downloads/batch", status_code=202)
+async def download_batch(request: BatchDownloadRequest):
     """
-    download model endpoints with path params url_type is civitai, huggingface and googledrive
+    queue many downloads at once. already installed files and duplicates are skipped,
+    the rest is ordered smallest first with connections sized for the whole set.
+    follow it with /api/downloads/batch/{batch_id}
     """
-    if not request.url:
-        raise HTTPException(status_code=400, detail="URL is required")
-
-    if url_type == "civitai":
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No downloads in the batch")
+    for item in request.items:
+        if item.source not in DOWNLOAD_SOURCES:
+            raise HTTPException(status_code=400, detail=f"Unknown source: {item.source}")
+    if request.engine and request.engine not in DOWNLOAD_ENGINES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown download engine: {request.engine}"
+        )
 
-        task = asyncio.create_task(
-            download_from_civitai_async(
-                request.url, request.api_key, request.model_type
+    async def resolve(item):
+        if item.source == "civitai":
+            return await model_resolver.resolve(item.url, request.api_key)
+        if item.source == "huggingface":
+            return await model_resolver.resolve(item.url)
+        return ResolvedModel(source=item.source, url=item.url)
+
+    # name, size, hash and type from the source, the planner only probes what's left
+    resolved = await asyncio.gather(*(resolve(item) for item in request.items))
+
+    items = []
+    for item, model in zip(request.items, resolved):
+        filename = item.filename.strip() if item.filename else model.filename
+        if not filename and item.source == "huggingface":
+            filename = url_filename(item.url)
+        items.append(
+            PlannedDownload(
+                url=model.url,
+                directory=model_dir_for(resolve_model_type(item.model_type, model)),
+                filename=filename,
+                size=model.size,
+                sha256=model.sha256,
+                payload=item,
             )
         )
 
-    elif url_type == "huggingface":
+    def probe_url(planned: PlannedDownload):
+        if planned.payload.source == "civitai":
+            return civitai_download_url(planned.url, request.api_key)
+        return planned.url
 
-        task = asyncio.create_task(
-            download_from_huggingface_async(request.url, request.model_type)
-        )
-    elif url_type == "googledrive":
+    plan = await plan_downloads(
+        items,
+        download_jobs.max_concurrent,
+        is_installed=_is_installed,
+        probe_url=probe_url,
+    )
 
-        custom_filename = (
-            request.filename if request.filename and request.filename.strip() else None
+    batch_id = uuid.uuid4().hex[:12]
+    jobs = []
+    # jobs don't go through the model store, a copy for another folder is its own job
+    for planned in plan.items + [item for item, _ in plan.copies]:
+        item = planned.payload
+        job = download_jobs.submit(
+            item.source,
+            item.url,
+            model_type=item.model_type,
+            api_key=request.api_key,
+            filename=item.filename.strip() if item.filename else None,
+            engine=request.engine,
+            batch_id=batch_id,
+            size=planned.size,
+            segments=planned.segments,
+            path=planned.path,
         )
-        task = asyncio.create_task(
-            download_from_googledrive_async(
-                request.url, request.model_type, custom_filename
-            )
+        jobs.append(job.public())
+
+    return {
+        "batch_id": batch_id,
+        "total_bytes": plan.total_bytes,
+        "jobs": jobs,
+        "skipped": [
+            {"url": item.url, "filename": item.filename, "reason": reason}
+            for item, reason in plan.skipped
+        ],
+    }
+
+
+@app.get("/api/downloads/batch/{batch_id}")
+async def api_download_batch(batch_id: str):
+    """API endpoint to get the aggregate progress of a batch"""
+    jobs = [job for job in download_jobs.list() if job.batch_id == batch_id]
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Download batch not found")
+
+    statuses = {}
+    completed_bytes = total_bytes = speed_bytes = 0
+    for job in jobs:
+        statuses[job.status] = statuses.get(job.status, 0) + 1
+        progress = progress_tracker.get(job.id) or {}
+        size = job.size or progress.get("total_bytes") or 0
+        total_bytes += size
+        if job.status == "completed":
+            completed_bytes += size
+        else:
+            completed_bytes += progress.get("completed_bytes") or 0
+        if job.status == "running":
+            speed_bytes += progress.get("speed_bytes") or 0
+
+    remaining = total_bytes - completed_bytes
+    return {
+        "batch_id": batch_id,
+        "jobs": len(jobs),
+        "statuses": statuses,
+        "done": all(job.status in FINISHED_STATUSES for job in jobs),
+        "completed_bytes": completed_bytes,
+        "total_bytes": total_bytes,
+        "percent": int(completed_bytes * 100 / total_bytes) if total_bytes else None,
+        "speed_bytes": speed_bytes,
+        "eta_seconds": int(remaining / speed_bytes) if speed_bytes else None,
+    }
+
+
+@app.post("/download/{url_type}", status_code=202)
+async def download(request: DownloadRequest, url_type: str):
+    """
+    download model endpoints with path params url_type is civitai, huggingface and googledrive.
+    the download is queued, the response carries the job id to follow it in /api/downloads
+    """
+    if not request.url:
+        raise HTTPException(status_code=400, detail="URL is required")
+
+    if url_type not in DOWNLOAD_SOURCES:
+        raise HTTPException(status_code=400, detail=f"Unknown source: {url_type}")
+
+    if request.engine and request.engine not in DOWNLOAD_ENGINES:
+        raise HTTPException(
+            status_code=400, detail=f"Unknown download engine: {request.engine}"
         )
 
-    background_tasks.add_task(lambda: task)
+    custom_filename = (
+        request.filename if request.filename and request.filename.strip() else None
+    )
+    job = download_jobs.submit(
+        url_type,
+        request.url,
+        model_type=request.model_type,
+        api_key=request.api_key,
+        filename=custom_filename,
+        engine=request.engine,
+    )
+    return {"job_id": job.id, "status": job.status}
+
+
+@app.get("/api/disk")
+async def api_disk():
+    """API endpoint to get the free space, download reservations and models quota"""
+    return await asyncio.get_running_loop().run_in_executor(
+        thread_executor, disk_space.status
+    )
+
+
+@app.get("/api/downloads")
+async def api_downloads():
+    """API endpoint to list queued, running and finished download jobs with their last progress"""
+    return [
+        {**job.public(), "progress": progress_tracker.get(job.id)}
+        for job in download_jobs.list()
+    ]
+
+
+@app.get("/api/downloads/{job_id}")
+async def api_download(job_id: str):
+    """API endpoint to get one download job"""
+    job = download_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Download job not found")
+    return {**job.public(), "progress": progress_tracker.get(job.id)}
+
+
+@app.get("/api/downloads/{job_id}/progress")
+async def api_download_progress(job_id: str):
+    """API endpoint to get the last known progress (bytes, speed, eta, connections) of a download"""
+    progress = progress_tracker.get(job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No progress for this download")
+    return progress
+
+
+@app.delete("/api/downloads/{job_id}")
+async def api_cancel_download(job_id: str):
+    """API endpoint to cancel a queued or running download job"""
+    job = download_jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Download job not found")
+    return job.public()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -169,11 +491,26 @@ async def index(request: Request):
     """
 
     # get log from log file
-    logs = get_current_logs()
+    log_lines = log_buffer.snapshot()
+    log_seq = log_lines[-1][0] if log_lines else log_buffer.last_seq
 
     # Get installed custom nodes and models
-    custom_nodes = get_installed_custom_nodes()
-    models = get_installed_models()
+    custom_nodes = await asyncio.get_running_loop().run_in_executor(
+        thread_executor, get_installed_custom_nodes
+    )
+
+    # the page only changes with the logs, the models and the custom nodes
+    page_key = json.dumps(
+        [model_inventory.etag, log_seq, custom_nodes, request.url.hostname]
+    )
+    etag = f'W/"{hashlib.md5(page_key.encode()).hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    logs = get_current_logs(log_lines)
+    models = await asyncio.get_running_loop().run_in_executor(
+        thread_executor, get_installed_models
+    )
 
     # Count total models
     total_models = sum(len(models[category]) for category in models)
@@ -206,6 +543,7 @@ async def index(request: Request):
         {
             "request": request,
             "logs": logs,
+            "log_seq": log_seq,
             "proxy_url": proxy_url,
             "jupyter_url": jupyter_url,
             "is_runpod": is_runpod,
@@ -213,26 +551,12 @@ async def index(request: Request):
             "models": models,
             "total_models": total_models,
         },
+        headers={"ETag": etag},
     )
 
 
 if __name__ == "__main__":
 
-    print("Starting log monitoring thread...")
-
-    # using new event loop + thread to handle read logs like tail -f (always read latest log)
-    loop = asyncio.new_event_loop()
-
-    log_thread = threading.Thread(
-        target=tlf_worker,
-        args=(
-            tail_log_file,
-            loop,
-        ),
-        daemon=True,
-    )
-    log_thread.start()
-
     print("Starting FastAPI log viewer on port 8189...")
 
     uvicorn.run(app, host="0.0.0.0", port=8189, log_level="info")
@@ -8,6 +8,7 @@ import safetensors.torch
 
 from pathlib import Path
 from tqdm import tqdm
+from modules_forge.safetensorsHeader import check_safetensors
 
 
 def gradio_url_ok_fix(url: str) -> bool:
@@ -33,6 +34,12 @@ def build_loaded(module, loader_name):
     def loader(*args, **kwargs):
         result = None
         try:
+            for path in list(args) + list(kwargs.values()):
+                if isinstance(path, str) and path.endswith('.safetensors') and os.path.exists(path):
+                    # cheap header check (cached), so a broken file fails before the full load
+                    error = check_safetensors(path)
+                    if error:
+                        raise ValueError(f'Invalid safetensors file: {error}')
             result = original_loader(*args, **kwargs)
         except RuntimeError as e:
             if "Can not safely load weights when explicit pickle_module is specified" in str(e):
@@ -6,6 +6,7 @@ export UPDATE_ON_START=${UPDATE_ON_START:-"false"}
 export MODELS_CONFIG_URL=${MODELS_CONFIG_URL:-"https://raw.githubusercontent.com/poomshift/forge-runpod-new/refs/heads/main/models_config.json"} 
 export SKIP_MODEL_DOWNLOAD=${SKIP_MODEL_DOWNLOAD:-"false"}
 export FORCE_MODEL_DOWNLOAD=${FORCE_MODEL_DOWNLOAD:-"false"}
+export WARM_MODEL_CACHE=${WARM_MODEL_CACHE:-"false"}
 export LOG_PATH=${LOG_PATH:-"/notebooks/backend.log"}
 
 export TORCH_FORCE_WEIGHTS_ONLY_LOAD=1
@@ -191,8 +192,23 @@ download_model() {
 }
 
 # Download models using Python helper (concurrent & robust)
+# Forge only waits for the critical models (checkpoint, VAE, text encoders), the rest
+# keep downloading in the background
+MODELS_READY_MARKER=${MODELS_READY_MARKER:-"/workspace/.forge_downloads/critical.ready"}
+export MODELS_READY_MARKER
+rm -f "$MODELS_READY_MARKER"
 echo "Invoking download_models.py to fetch required models..." | tee -a /workspace/logs/forge.log
-python /notebooks/download_models.py 2>&1 | tee -a /workspace/logs/forge.log
+python /notebooks/download_models.py 2>&1 | tee -a /workspace/logs/forge.log &
+DOWNLOAD_PID=$!
+while [ ! -f "$MODELS_READY_MARKER" ] && kill -0 $DOWNLOAD_PID 2>/dev/null; do
+    sleep 2
+done
+
+# Optionally pull the configured checkpoints into the page cache while Forge starts
+if [ "$WARM_MODEL_CACHE" = "true" ]; then
+    echo "Warming the page cache for configured models..." | tee -a /workspace/logs/forge.log
+    nohup python /notebooks/warm_cache.py >>/workspace/logs/forge.log 2>&1 &
+fi
 
 # Start Jupyter with GPU isolation
 CUDA_VISIBLE_DEVICES="" jupyter lab --allow-root --no-browser --ip=0.0.0.0 --port=8888 --NotebookApp.token="" --NotebookApp.password="" --notebook-dir=/workspace &
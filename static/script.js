@@ -1,7 +1,10 @@
 let socket;
-let lastLogHash = "";
-let logUpdateCounter = 0;
+let lastLogSeq = 0;
+let lastLogEtag = null;
+let pollTimer = null;
 let isUpdating = false;
+// websocket frames held back while the catch-up fetch after a (re)connect runs
+let catchUpFrames = null;
 let autoScroll = true;
 let userScrolled = false;
 let reconnectAttempts = 0;
@@ -19,17 +22,6 @@ const statusMapping = {
   gdrive: "gdDownloadStatus",
 };
 
-function generateRandomString(length) {
-  const characters =
-    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789";
-  let result = "";
-  for (let i = 0; i < length; i++) {
-    result += characters.charAt(Math.floor(Math.random() * characters.length));
-  }
-
-  return result;
-}
-
 var support = (function () {
   if (!window.DOMParser) return false;
   var parser = new DOMParser();
@@ -68,12 +60,26 @@ function initializeWebSocket() {
     socket.onopen = function () {
       console.log("WebSocket connected");
       reconnectAttempts = 0;
+
+      // websocket is healthy: catch up on what we missed once and stop polling
+      stopAutoPoll();
+      catchUpLogs();
     };
 
     socket.onmessage = function (event) {
       const msg = JSON.parse(event.data);
-      if (msg.type === "new_log_line") {
-        appendLogWs(msg);
+      if (msg.type === "new_log_lines") {
+        receiveLogLines(msg.lines, msg.seq || 0);
+      } else if (msg.type === "new_log_line") {
+        receiveLogLines([msg.line], msg.seq || 0);
+      } else if (msg.type === "log_skipped") {
+        appendLogLines([
+          `<span class='log-warning'>... skipped ${msg.count} lines (connection too slow) ...</span>`,
+        ]);
+      } else if (msg.type === "download_progress") {
+        showDownloadProgress(msg.data);
+      } else if (msg.type === "download_job") {
+        showDownloadJob(msg.data);
       } else if (msg.type === "download") {
         const button_source = sourceMapping[msg.data.source];
         const status_source = statusMapping[msg.data.source];
@@ -92,6 +98,11 @@ function initializeWebSocket() {
             statusDiv.textContent = `Download Error ${msg.data.detail}`;
             statusDiv.className = "status-message status-error";
             break;
+          case "cancelled":
+            btn.disabled = false;
+            statusDiv.textContent = "Download Cancelled";
+            statusDiv.className = "status-message status-error";
+            break;
           case "downloading":
             btn.disabled = true;
             statusDiv.textContent = "Downloading...";
@@ -103,6 +114,7 @@ function initializeWebSocket() {
 
     socket.onclose = function () {
       console.log("WebSocket disconnected");
+      startAutoPoll();
       // Attempt to reconnect
       if (reconnectAttempts < maxReconnectAttempts) {
         reconnectAttempts++;
@@ -113,23 +125,64 @@ function initializeWebSocket() {
       }
     };
 
-    socket.onerror = function () {
+    socket.onerror = function (error) {
       startAutoPoll();
       console.error("WebSocket error:", error);
     };
   } catch (e) {
     console.error("WebSocket initialization failed:", e);
+    startAutoPoll();
+  }
+}
+
+function catchUpLogs() {
+
+  // fetch what was logged while disconnected. it runs even when a batch is
+  // still rendering (polling is already stopped, nothing would fetch it later)
+  // and frames arriving meanwhile wait for it, they would move lastLogSeq past
+  // the lines it brings
+
+  catchUpFrames = catchUpFrames || [];
+  fetchLatestLogs(true).finally(() => {
+    const frames = catchUpFrames || [];
+    catchUpFrames = null;
+    for (const [lines, seq] of frames) {
+      appendNewLogLines(lines, seq);
+    }
+  });
+}
+
+function receiveLogLines(lines, lastSeq) {
+  if (catchUpFrames) {
+    catchUpFrames.push([lines, lastSeq]);
+  } else {
+    appendNewLogLines(lines, lastSeq);
   }
 }
 
-function appendLogWs(data) {
+function appendNewLogLines(lines, lastSeq) {
 
-  // append logs + scroll down and remove element when it more than 500 lines.
+  // lines of a websocket frame are consecutive and `lastSeq` is the last one, skip the
+  // ones the catch-up fetch already showed (both run right after a reconnect)
+
+  const firstSeq = lastSeq - lines.length + 1;
+  const fresh = lines.filter((_, i) => firstSeq + i > lastLogSeq);
+  if (fresh.length) {
+    appendLogLines(fresh);
+  }
+  lastLogSeq = Math.max(lastLogSeq, lastSeq);
+}
+
+function appendLogLines(lines) {
+
+  // append a batch of log lines in one DOM operation + scroll down and trim to 500 lines.
 
   const logBox = document.getElementById("log-box");
-  const parsed = stringToHTML(data.line);
+  const fragment = document.createDocumentFragment();
+  for (const line of lines) {
+    fragment.appendChild(stringToHTML(line));
+  }
 
-  // Only update if content actually changed
   isUpdating = true;
 
   // Save current scroll position and check if scrolled to bottom
@@ -137,72 +190,92 @@ function appendLogWs(data) {
     isScrolledToBottom(logBox) || (autoScroll && !userScrolled);
   const scrollPos = logBox.scrollTop;
 
-  // Update content with minimal flickering
   requestAnimationFrame(() => {
-    logBox.style.opacity = "0.7";
-
-    logBox.appendChild(parsed);
-    // Use timeout to allow the opacity transition to happen
-    setTimeout(() => {
-      logBox.style.opacity = "1";
+    logBox.appendChild(fragment);
 
-      if (logBox.childNodes.length > 500) {
-        logBox.removeChild(logBox.firstChild);
-      }
+    while (logBox.childNodes.length > 500) {
+      logBox.removeChild(logBox.firstChild);
+    }
 
-      // Maintain scroll position
-      if (wasAtBottom) {
-        scrollToBottom(logBox);
-      } else {
-        logBox.scrollTop = scrollPos;
-      }
+    // Maintain scroll position
+    if (wasAtBottom) {
+      scrollToBottom(logBox);
+    } else {
+      logBox.scrollTop = scrollPos;
+    }
 
-      isUpdating = false;
-    }, 50);
+    isUpdating = false;
   });
 }
 
-function updateLogBoxSmoothly(logs) {
+function replaceLogLines(lines) {
 
-  // for logs polling method.
-
-  if (!logs || isUpdating) return;
+  // replace the whole log box, used when the server says our cursor is too old.
 
   const logBox = document.getElementById("log-box");
+  logBox.innerHTML = "";
+  appendLogLines(lines);
+}
 
-  // Generate simple hash of the log content to check for changes
-  const hash = generateRandomString(10);
+function formatBytes(bytes) {
+  if (!bytes) return "0 B";
+  const units = ["B", "KiB", "MiB", "GiB", "TiB"];
+  const i = Math.min(Math.floor(Math.log(bytes) / Math.log(1024)), units.length - 1);
+  return `${(bytes / Math.pow(1024, i)).toFixed(1)} ${units[i]}`;
+}
 
-  if (hash !== lastLogHash) {
-    // Only update if content actually changed
-    isUpdating = true;
+function showDownloadProgress(data) {
 
-    // Save current scroll position and check if scrolled to bottom
-    const wasAtBottom =
-      isScrolledToBottom(logBox) || (autoScroll && !userScrolled);
-    const scrollPos = logBox.scrollTop;
+  // live progress of a running download (bytes, speed, eta).
 
-    // Update content with minimal flickering
-    requestAnimationFrame(() => {
-      logBox.style.opacity = "0.7";
+  const source = data.source === "googledrive" ? "gdrive" : data.source;
+  const statusDiv = document.getElementById(statusMapping[source]);
+  if (!statusDiv || data.status === "completed") return;
 
-      // Use timeout to allow the opacity transition to happen
-      setTimeout(() => {
-        logBox.innerHTML = logs;
-        logBox.style.opacity = "1";
+  let text = `Downloading... ${formatBytes(data.completed_bytes)}`;
+  if (data.total_bytes) {
+    text += ` / ${formatBytes(data.total_bytes)} (${data.percent ?? 0}%)`;
+  }
+  text += ` at ${formatBytes(data.speed_bytes)}/s`;
+  if (data.eta_seconds != null) text += `, ETA ${data.eta_seconds}s`;
+  if (data.connections) text += `, ${data.connections} connections`;
 
-        // Maintain scroll position
-        if (wasAtBottom) {
-          scrollToBottom(logBox);
-        } else {
-          logBox.scrollTop = scrollPos;
-        }
+  statusDiv.style.display = "block";
+  statusDiv.className = "status-message";
+  statusDiv.textContent = text;
+}
 
-        lastLogHash = hash;
-        isUpdating = false;
-      }, 50);
-    });
+function showDownloadJob(job) {
+
+  // job state changes: waiting for disk space, rejected, cancelled.
+  // batch jobs have their own progress, they don't touch the forms
+
+  if (job.batch_id) return;
+  const source = job.source === "googledrive" ? "gdrive" : job.source;
+  const btn = document.getElementById(sourceMapping[source]);
+  const statusDiv = document.getElementById(statusMapping[source]);
+  if (!btn || !statusDiv) return;
+
+  switch (job.status) {
+    case "queued":
+      if (!job.message) return;
+      statusDiv.textContent = `Queued, ${job.message}`;
+      statusDiv.className = "status-message";
+      break;
+    case "failed":
+      btn.disabled = false;
+      statusDiv.textContent = `Download Error ${job.message || ""}`;
+      statusDiv.className = "status-message status-error";
+      break;
+    case "cancelled":
+      btn.disabled = false;
+      statusDiv.textContent = "Download Cancelled";
+      statusDiv.className = "status-message status-error";
+      break;
+    default:
+      return;
   }
+  statusDiv.style.display = "block";
 }
 
 function isScrolledToBottom(element) {
@@ -240,41 +313,65 @@ function toggleAutoScroll() {
   console.log("Auto-scroll " + (autoScroll ? "enabled" : "disabled"));
 }
 
-function fetchLatestLogs(isManualRefresh) {
+function fetchLatestLogs(force = false) {
+
+  // incremental polling: only ask for lines after the last sequence number we have.
+  // a poll is skipped while a batch renders, `force` (the catch-up) never is
 
-  // fallback when ws is not support.
+  if (isUpdating && !force) return Promise.resolve();
 
-  if (isUpdating && !isManualRefresh) return;
+  const headers = {};
+  if (lastLogEtag) {
+    headers["If-None-Match"] = lastLogEtag;
+  }
 
-  console.log("Fetching latest logs...");
-  fetch("/logs", {
+  return fetch(`/logs?since=${lastLogSeq}`, {
     method: "GET",
-    cache: "no-cache",
-    headers: {
-      "Cache-Control": "no-cache",
-      Pragma: "no-cache",
-    },
+    cache: "no-store",
+    headers: headers,
   })
-    .then((response) => response.json())
+    .then((response) => {
+      // 304 = nothing new since the last poll
+      if (response.status === 304) return null;
+      lastLogEtag = response.headers.get("ETag");
+      return response.json();
+    })
     .then((data) => {
-      if (data && data.logs) {
-        console.log("Latest logs received, updating display");
-        updateLogBoxSmoothly(data.logs);
-      } else {
-        console.warn("No logs data in response");
-        document.getElementById("log-box").style.opacity = "1";
+      if (!data) return;
+
+      if (data.reset) {
+        // the viewer restarted or lines were dropped, the sequence may start over
+        replaceLogLines(data.lines.map((line) => line.html));
+        lastLogSeq = data.seq;
+        return;
       }
+
+      // websocket frames may have delivered some of these lines meanwhile
+      const lines = data.lines
+        .filter((line) => line.seq > lastLogSeq)
+        .map((line) => line.html);
+      if (lines.length) {
+        appendLogLines(lines);
+      }
+      lastLogSeq = Math.max(lastLogSeq, data.seq);
     })
     .catch((error) => {
       console.error("Error fetching logs:", error);
-      document.getElementById("log-box").style.opacity = "1";
     });
 }
 
-// Auto-poll for logs every 3 seconds as fallback
+// Auto-poll for logs every 3 seconds as fallback while the websocket is down
 function startAutoPoll() {
+  if (pollTimer) return;
   console.log("Starting auto polling");
-  setInterval(() => fetchLatestLogs(false), 3000);
+  pollTimer = setInterval(() => fetchLatestLogs(), 3000);
+}
+
+function stopAutoPoll() {
+  if (!pollTimer) return;
+  console.log("Stopping auto polling");
+  clearInterval(pollTimer);
+  pollTimer = null;
 }
 
 // download from civitai website
@@ -297,12 +394,12 @@ async function downloadFromCivitai() {
       }),
     });
 
-    if (response.status === 204) {
+    if (response.status === 202) {
       civitaibutton.disabled = true;
 
       statusDiv.className = "status-message";
       statusDiv.style.display = "block";
-      statusDiv.textContent = "Downloading...";
+      statusDiv.textContent = "Queued...";
     } else {
       const data = await response.json();
 
@@ -329,12 +426,12 @@ async function downloadFromHuggingFace() {
       body: JSON.stringify({ url: url, model_type: modelType }),
     });
 
-    if (response.status === 204) {
+    if (response.status === 202) {
       huggingfacebutton.disabled = true;
 
       statusDiv.className = "status-message";
       statusDiv.style.display = "block";
-      statusDiv.textContent = "Downloading...";
+      statusDiv.textContent = "Queued...";
     } else {
       const data = await response.json();
       throw { message: data.detail };
@@ -365,12 +462,12 @@ async function downloadFromGoogleDrive() {
       }),
     });
 
-    if (response.status === 204) {
+    if (response.status === 202) {
       gdrivebutton.disabled = true;
 
       statusDiv.className = "status-message";
       statusDiv.style.display = "block";
-      statusDiv.textContent = "Downloading...";
+      statusDiv.textContent = "Queued...";
     } else {
       const data = await response.json();
       throw { message: data.detail };
@@ -400,6 +497,9 @@ function switchTab(tabName) {
 document.addEventListener("DOMContentLoaded", function () {
   console.log("Page loaded, initializing systems");
 
+  // sequence number of the last log line rendered by the server
+  lastLogSeq = parseInt(document.getElementById("log-box").dataset.seq || "0", 10);
+
   // Initialize WebSocket and fallback polling
   initializeWebSocket();
 
@@ -408,6 +508,7 @@ document.addEventListener("DOMContentLoaded", function () {
 
   // Set up auto-scroll toggle from saved preference
   const logBox = document.getElementById("log-box");
+
   const savedAutoScroll = localStorage.getItem("autoScroll");
   if (savedAutoScroll !== null) {
     autoScroll = savedAutoScroll === "true";
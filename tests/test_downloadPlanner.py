@@ -0,0 +1,32 @@
+import asyncio
+
+from workers.downloadPlanner import PlannedDownload, plan_downloads
+
+
+def plan(items):
+    return asyncio.run(plan_downloads(items, concurrency=3))
+
+
+def test_same_url_in_two_folders_is_a_copy():
+    lora = PlannedDownload("https://x/m", "/m/Lora", "m.safetensors", size=1)
+    checkpoint = PlannedDownload(
+        "https://x/m", "/m/Stable-diffusion", "m.safetensors", size=1, critical=True
+    )
+    result = plan([lora, checkpoint])
+
+    assert result.items == [lora]
+    assert result.copies == [(checkpoint, lora)]
+    assert result.skipped == []
+    # Forge waits for the copy, so it waits for the download too
+    assert lora.critical
+
+
+def test_same_hash_is_a_copy_same_target_a_duplicate():
+    first = PlannedDownload("https://x/a", "/m/Lora", "a", size=1, sha256="ab" * 32)
+    other_url = PlannedDownload("https://y/a", "/m/VAE", "a", size=1, sha256="ab" * 32)
+    same_target = PlannedDownload("https://z/a", "/m/Lora", "a", size=1)
+    result = plan([first, other_url, same_target])
+
+    assert result.items == [first]
+    assert result.copies == [(other_url, first)]
+    assert result.skipped == [(same_target, "duplicate")]
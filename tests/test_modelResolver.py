@@ -0,0 +1,39 @@
+import pytest
+
+from workers.modelResolver import select_civitai_file
+
+URL = "https://civitai.com/api/download/models/123"
+FILES = [
+    {
+        "name": "model-pruned.safetensors",
+        "type": "Model",
+        "primary": True,
+        "metadata": {"format": "SafeTensor", "size": "pruned", "fp": "fp16"},
+    },
+    {
+        "name": "model-full.ckpt",
+        "type": "Model",
+        "metadata": {"format": "PickleTensor", "size": "full", "fp": "fp32"},
+    },
+    {"name": "model-vae.safetensors", "type": "VAE", "metadata": {"format": "SafeTensor"}},
+]
+
+
+@pytest.mark.parametrize(
+    "query, expected",
+    [
+        ("", "model-pruned.safetensors"),
+        ("?type=VAE", "model-vae.safetensors"),
+        ("?type=Model&format=SafeTensor&size=pruned&fp=fp16", "model-pruned.safetensors"),
+        ("?type=Model&format=PickleTensor", "model-full.ckpt"),
+        # two model files match, civitai serves the primary one
+        ("?type=Model", "model-pruned.safetensors"),
+    ],
+)
+def test_selectors_pick_the_downloaded_file(query, expected):
+    assert select_civitai_file(FILES, URL + query)["name"] == expected
+
+
+def test_no_clear_match_gives_nothing():
+    assert select_civitai_file(FILES, URL + "?fp=bf16") is None
+    assert select_civitai_file(FILES[1:], URL + "?type=Model&format=SafeTensor") is None
@@ -0,0 +1,24 @@
+import asyncio
+
+from workers.modelStore import ModelStore
+
+
+def test_two_processes_keep_each_others_changes(tmp_path):
+    models = tmp_path / "models"
+    models.mkdir()
+    for name in ("a", "b", "c"):
+        (models / name).write_text(name)
+
+    # download_models.py and the log viewer, each with its own copy of the index
+    first = ModelStore(str(tmp_path / "store"))
+    second = ModelStore(str(tmp_path / "store"))
+    sha_a = asyncio.run(first.add(str(models / "a"), "url-a"))
+    sha_b = asyncio.run(second.add(str(models / "b"), "url-b"))
+    sha_c = asyncio.run(first.add(str(models / "c"), "url-c"))
+    second.remove(sha_a)
+    assert first.link_from_store("url-b2", str(models / "b2"), sha_b)
+
+    index = ModelStore(str(tmp_path / "store"))
+    assert set(index.objects) == {sha_b, sha_c}
+    assert index.urls == {"url-b": sha_b, "url-b2": sha_b, "url-c": sha_c}
+    assert index.objects[sha_b]["paths"] == [str(models / "b"), str(models / "b2")]
@@ -0,0 +1,138 @@
+import asyncio
+import json
+import os
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from workers import rangeDownloader
+from workers.rangeDownloader import RangeDownloadError, download_with_ranges
+
+DATA = os.urandom(64 * 1024 + 123)
+
+
+class RangeServer:
+    """Local file server answering range requests, with knobs to misbehave"""
+
+    def __init__(self, ranges=True, fail_first=0, always_fail_start=None, delay=0):
+        self.ranges = ranges
+        self.delay = delay
+        self.fail_first = fail_first
+        self.always_fail_start = always_fail_start
+        self.requests = []
+        self.served_bytes = 0
+
+    async def handle(self, request):
+        header = request.headers.get("Range")
+        self.requests.append(header)
+        headers = {"Content-Disposition": 'attachment; filename="model.safetensors"'}
+        if not header or not self.ranges:
+            self.served_bytes += len(DATA)
+            return web.Response(body=DATA, headers=headers)
+
+        start, end = header[len("bytes=") :].split("-")
+        start, end = int(start), int(end or len(DATA) - 1)
+        if header != "bytes=0-0":
+            if start == self.always_fail_start:
+                return web.Response(status=500)
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return web.Response(status=503)
+            await asyncio.sleep(self.delay)
+
+        body = DATA[start : end + 1]
+        self.served_bytes += len(body)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(DATA)}"
+        return web.Response(status=206, body=body, headers=headers)
+
+
+@pytest.fixture(autouse=True)
+def small_segments(monkeypatch):
+    monkeypatch.setattr(rangeDownloader, "MIN_SEGMENT_SIZE", 4096)
+    monkeypatch.setattr(rangeDownloader, "RETRY_BACKOFF", 0.01)
+
+
+def run(server, coroutine_factory):
+    async def main():
+        app = web.Application()
+        app.router.add_get("/file", server.handle)
+        async with TestServer(app) as test_server:
+            return await coroutine_factory(str(test_server.make_url("/file")))
+
+    return asyncio.run(main())
+
+
+def test_full_download(tmp_path):
+    server = RangeServer()
+    path = run(server, lambda url: download_with_ranges(url, tmp_path, segments=4))
+
+    assert path == str(tmp_path / "model.safetensors")
+    assert open(path, "rb").read() == DATA
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path + ".part.json")
+    # the probe plus one request per segment
+    assert len(server.requests) == 5
+
+
+def test_resume_from_part_file(tmp_path):
+    target = tmp_path / "model.safetensors"
+    half = len(DATA) // 2
+    with open(str(target) + ".part", "wb") as f:
+        f.write(DATA[:half] + b"\0" * (len(DATA) - half))
+    with open(str(target) + ".part.json", "w") as f:
+        json.dump(
+            {
+                "size": len(DATA),
+                "segments": [[0, half - 1, half], [half, len(DATA) - 1, 0]],
+            },
+            f,
+        )
+
+    server = RangeServer()
+    path = run(server, lambda url: download_with_ranges(url, tmp_path, segments=4))
+
+    assert open(path, "rb").read() == DATA
+    # only the missing half (and the 1 byte probe) was downloaded again
+    assert server.served_bytes == len(DATA) - half + 1
+
+
+def test_retry_with_backoff(tmp_path):
+    server = RangeServer(fail_first=3)
+    path = run(server, lambda url: download_with_ranges(url, tmp_path, segments=2))
+
+    assert open(path, "rb").read() == DATA
+    assert server.fail_first == 0
+
+
+def test_fallback_without_range_support(tmp_path):
+    server = RangeServer(ranges=False)
+    path = run(server, lambda url: download_with_ranges(url, tmp_path, segments=4))
+
+    assert open(path, "rb").read() == DATA
+    # the probe and a single plain stream
+    assert server.requests == ["bytes=0-0", None]
+
+
+def test_segment_failure_stops_other_segments(tmp_path):
+    # the other segments are still in flight when segment 0 gives up
+    server = RangeServer(always_fail_start=0, delay=2)
+
+    async def download(url):
+        with pytest.raises(RangeDownloadError):
+            await download_with_ranges(url, tmp_path, segments=8)
+        # no segment task outlives the download (they would write into a closed fd)
+        return [
+            task
+            for task in asyncio.all_tasks()
+            if task.get_coro().__name__ == "_download_segment" and not task.done()
+        ]
+
+    leftover = run(server, download)
+
+    assert leftover == []
+    target = tmp_path / "model.safetensors"
+    assert not target.exists()
+    # the partial file and its state stay for a resume
+    assert os.path.exists(str(target) + ".part")
+    assert os.path.exists(str(target) + ".part.json")
@@ -1,28 +1,55 @@
 import html
 import re
+from collections import namedtuple
 from datetime import datetime
 
+# parsed log line, `content` is already html escaped
+LogRecord = namedtuple("LogRecord", ["timestamp", "level", "content"])
 
-def format_log_line(line, ws=False):
-    """Format a log line to match Docker container log style"""
+_TIMESTAMP_PATTERN = re.compile(r"^\[([\d\-\s:]+)\]")
+
+# one matcher for the level: error keywords anywhere win over warning keywords anywhere
+_LEVEL_PATTERN = re.compile(
+    r"(?=.*?(?P<error>error|exception|fail|critical))|(?=.*?(?P<warning>warn|caution))",
+    re.IGNORECASE | re.DOTALL,
+)
+
+_LEVEL_CSS_CLASS = {
+    "error": "log-error",
+    "warning": "log-warning",
+    "info": "log-info",
+}
+
+
+def parse_log_line(line):
+    """Parse a raw log line once into a LogRecord (timestamp, level, escaped content)"""
     # Extract timestamp if present, or generate one
-    timestamp_match = re.search(r"^\[([\d\-\s:]+)\]", line)
+    timestamp_match = _TIMESTAMP_PATTERN.match(line)
     if timestamp_match:
         timestamp = timestamp_match.group(1)
-        content = line[len(timestamp_match.group(0)) :].strip()
+        content = line[timestamp_match.end() :].strip()
     else:
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
         content = line
 
     # Determine log level based on content
-    css_class = "log-info"
-    if re.search(r"error|exception|fail|critical", content, re.IGNORECASE):
-        css_class = "log-error"
-    elif re.search(r"warn|caution", content, re.IGNORECASE):
-        css_class = "log-warning"
+    level = "info"
+    level_match = _LEVEL_PATTERN.match(content)
+    if level_match:
+        level = level_match.lastgroup
 
-    # Format the line with HTML
+    return LogRecord(timestamp, level, html.escape(content))
+
+
+def render_log_record(record, ws=False):
+    """Render a LogRecord to html, `ws` renders only the inner spans"""
+    spans = f"<span class='log-timestamp'>{record.timestamp}</span><span class='{_LEVEL_CSS_CLASS[record.level]}'>{record.content}</span>"
     if ws:
-        return f"<span class='log-timestamp'>{timestamp}</span><span class='{css_class}'>{html.escape(content)}</span>"
+        return spans
+
+    return f"<div class='log-line'>{spans}</div>"
 
-    return f"<div class='log-line'><span class='log-timestamp'>{timestamp}</span><span class='{css_class}'>{html.escape(content)}</span></div>"
+
+def format_log_line(line, ws=False):
+    """Format a log line to match Docker container log style"""
+    return render_log_record(parse_log_line(line), ws)
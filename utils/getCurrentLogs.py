@@ -1,28 +1,54 @@
 from datetime import datetime
 
-from constants.logLock import log_buffer, log_lock
-from utils.formatLogLine import format_log_line
+from constants.logLock import log_buffer
+from utils.formatLogLine import render_log_record
 
 
-def get_current_logs():
+def get_current_logs(lines=None):
     """Get the current logs from the buffer with Docker-style formatting"""
-    with log_lock:
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        header = f"<div class='log-line'><span class='log-timestamp'>{timestamp}</span><span class='log-info'>Log Viewer - Last {len(log_buffer)} lines</span></div>\n"
-
-        # Return log buffer with Docker-style formatting
-        if log_buffer:
-            formatted_logs = []
-            prev_line = None
-            for line in log_buffer:
-                if line != prev_line:  # Avoid duplicate consecutive lines
-                    # Format the log line with timestamp and color coding
-                    formatted_line = format_log_line(line)
-                    formatted_logs.append(formatted_line)
-                prev_line = line
-            return header + "\n".join(formatted_logs)
-        else:
-            return (
-                header
-                + "<div class='log-line'><span class='log-info'>No logs yet.</span></div>"
-            )
+    # take a snapshot so the tail thread isn't blocked while we format
+    if lines is None:
+        lines = log_buffer.snapshot()
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    header = f"<div class='log-line'><span class='log-timestamp'>{timestamp}</span><span class='log-info'>Log Viewer - Last {len(lines)} lines</span></div>\n"
+
+    # Return log buffer with Docker-style formatting
+    if lines:
+        # records are parsed at ingest (duplicates already skipped), only render here
+        return header + "\n".join(render_log_record(record) for _, record in lines)
+    else:
+        return (
+            header
+            + "<div class='log-line'><span class='log-info'>No logs yet.</span></div>"
+        )
+
+
+def get_logs_since(since):
+    """
+    Get the lines after sequence number `since` as structured records.
+
+    `reset` is true when lines between `since` and the oldest buffered line were
+    already dropped from the ring buffer (or the viewer restarted and the sequence
+    numbers started over), the client should then replace what it shows.
+    """
+    restarted = since > log_buffer.last_seq
+    if restarted:
+        since = 0
+
+    lines = log_buffer.snapshot(since)
+    seq = lines[-1][0] if lines else log_buffer.last_seq
+
+    return {
+        "seq": seq,
+        "reset": restarted or (bool(lines) and lines[0][0] > since + 1),
+        "lines": [
+            {
+                "seq": line_seq,
+                "timestamp": record.timestamp,
+                "level": record.level,
+                "html": render_log_record(record, ws=True),
+            }
+            for line_seq, record in lines
+        ],
+    }
@@ -0,0 +1,25 @@
+import json
+import os
+
+
+def write_json_atomic(path, data, mode=0o644):
+    """
+    Write `data` as json to `path` through a tmp file and a rename, readers see
+    the old or the new file, never half of one. The tmp name carries the pid so
+    two processes saving the same file don't truncate each other's tmp file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        with open(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,34 @@
+import json
+from typing import Any, Dict, Optional
+
+import aiohttp
+
+# Model category to Forge folder mapping
+CATEGORY_TO_PATH = {
+    "Stable-diffusion": "models/Stable-diffusion",
+    "VAE": "models/VAE",
+    "Lora": "models/Lora",
+    "ESRGAN": "models/ESRGAN",
+    "ControlNet": "models/ControlNet",
+    "text_encoder": "models/text_encoder",
+}
+
+
+async def get_config_async(config_path: str) -> Optional[Dict[str, Any]]:
+    """Load configuration from file or URL (async)"""
+    try:
+        # Check if it's a URL
+        if config_path.startswith(("http://", "https://")):
+            async with aiohttp.ClientSession() as session:
+                async with session.get(config_path) as response:
+                    response.raise_for_status()
+                    # Get text content and parse as JSON manually to handle GitHub's text/plain mimetype
+                    text_content = await response.text()
+                    return json.loads(text_content)
+        else:
+            # Load from local file
+            with open(config_path, "r") as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"Failed to load config from {config_path}: {e}")
+        return None
@@ -0,0 +1,207 @@
+import json
+import os
+import struct
+import threading
+
+# relative: this file is also copied into Forge's modules_forge (with jsonFile.py)
+from .jsonFile import write_json_atomic
+
+# the format caps the header at 100MB, anything bigger is not a safetensors file
+MAX_HEADER_SIZE = 100 * 1024 * 1024
+
+
+class SafetensorsHeaderError(ValueError):
+    pass
+
+
+def read_safetensors_header(path):
+    """
+    Read only the JSON header of a safetensors file (never the tensor data).
+
+    The file starts with a little-endian u64 header length followed by the
+    header: {"__metadata__": {...}, "<tensor>": {"dtype", "shape", "data_offsets"}}.
+    Returns (header dict, header length).
+    """
+    with open(path, "rb") as f:
+        prefix = f.read(8)
+        if len(prefix) != 8:
+            raise SafetensorsHeaderError("file is shorter than the header length")
+        (header_size,) = struct.unpack("<Q", prefix)
+        if header_size > MAX_HEADER_SIZE:
+            raise SafetensorsHeaderError(f"header length {header_size} is too large")
+
+        raw = f.read(header_size)
+        if len(raw) != header_size:
+            raise SafetensorsHeaderError("file ends inside the header")
+
+    try:
+        header = json.loads(raw)
+    except ValueError as e:
+        raise SafetensorsHeaderError(f"header is not valid json: {e}")
+    if not isinstance(header, dict):
+        raise SafetensorsHeaderError("header is not a json object")
+    return header, header_size
+
+
+# bytes per element of every safetensors dtype
+DTYPE_SIZES = {
+    "F64": 8,
+    "F32": 4,
+    "F16": 2,
+    "BF16": 2,
+    "F8_E4M3": 1,
+    "F8_E5M2": 1,
+    "I64": 8,
+    "I32": 4,
+    "I16": 2,
+    "I8": 1,
+    "U64": 8,
+    "U32": 4,
+    "U16": 2,
+    "U8": 1,
+    "BOOL": 1,
+}
+
+# verdicts survive restarts so a checked file isn't checked again before every load
+VERDICT_FILE = os.getenv(
+    "SAFETENSORS_VERDICT_FILE",
+    os.path.join("/workspace", ".forge_downloads", "safetensors_verdicts.json"),
+)
+
+
+def _is_size(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def validate_safetensors(path):
+    """
+    Check the structure of a safetensors file without reading tensor data.
+
+    The header must parse, every tensor of a known dtype must have offsets
+    matching its shape, the tensors must cover the data area without gaps or
+    overlaps, and the file must be exactly as long as the header says (a
+    truncated download fails here). Raises SafetensorsHeaderError with the reason.
+    """
+    header, header_size = read_safetensors_header(path)
+    data_size = os.path.getsize(path) - 8 - header_size
+
+    spans = []
+    for name, tensor in header.items():
+        if name == "__metadata__":
+            continue
+        try:
+            dtype = tensor["dtype"]
+            shape = tensor["shape"]
+            begin, end = tensor["data_offsets"]
+        except (TypeError, KeyError, ValueError):
+            raise SafetensorsHeaderError(f"tensor {name} has an invalid header entry")
+        if not (
+            isinstance(dtype, str)
+            and _is_size(begin)
+            and _is_size(end)
+            and begin <= end
+            and isinstance(shape, list)
+            and all(_is_size(dim) for dim in shape)
+        ):
+            raise SafetensorsHeaderError(
+                f"tensor {name} has invalid offsets {begin}-{end} or shape {shape}"
+            )
+
+        # newer dtypes (F8_E8M0, F4, F6_*, C64...) can't be sized here, the
+        # offsets tiling and the file length still check them
+        if dtype in DTYPE_SIZES:
+            count = 1
+            for dim in shape:
+                count *= dim
+            if end - begin != count * DTYPE_SIZES[dtype]:
+                raise SafetensorsHeaderError(
+                    f"tensor {name} offsets {begin}-{end} don't match {dtype} {shape}"
+                )
+        spans.append((begin, end, name))
+
+    position = 0
+    for begin, end, name in sorted(spans):
+        if begin != position:
+            raise SafetensorsHeaderError(
+                f"tensor {name} starts at {begin}, expected {position}"
+            )
+        position = end
+
+    if position != data_size:
+        raise SafetensorsHeaderError(
+            f"file has {data_size} bytes of tensor data, header describes {position}"
+            + (" (truncated download?)" if data_size < position else "")
+        )
+
+
+class SafetensorsVerdictCache:
+    """
+    Results of validate_safetensors keyed by path, valid while size and mtime are unchanged.
+
+    The verdicts are saved to `verdict_file` and re-read when another process
+    (download_models.py or Forge) updated it.
+    """
+
+    def __init__(self, verdict_file=VERDICT_FILE):
+        self.verdict_file = verdict_file
+        self._verdicts = {}
+        self._file_mtime = None
+        self._lock = threading.Lock()
+
+    def check(self, path):
+        """Return None when the file is valid, else the reason it isn't"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            self._reload()
+            verdict = self._verdicts.get(path)
+            if (
+                verdict
+                and verdict["size"] == stat.st_size
+                and verdict["mtime_ns"] == stat.st_mtime_ns
+            ):
+                return verdict["error"]
+
+        try:
+            validate_safetensors(path)
+            error = None
+        except (OSError, SafetensorsHeaderError) as e:
+            error = str(e)
+
+        with self._lock:
+            self._verdicts[path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "error": error,
+            }
+            self._save()
+        return error
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.verdict_file).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._file_mtime:
+            return
+        try:
+            with open(self.verdict_file, "r") as f:
+                self._verdicts.update(json.load(f))
+            self._file_mtime = mtime
+        except Exception as e:
+            print(f"Error loading safetensors verdicts from {self.verdict_file}: {e}")
+
+    def _save(self):
+        try:
+            write_json_atomic(self.verdict_file, self._verdicts)
+            self._file_mtime = os.stat(self.verdict_file).st_mtime_ns
+        except Exception as e:
+            print(f"Error saving safetensors verdicts to {self.verdict_file}: {e}")
+
+
+safetensors_verdicts = SafetensorsVerdictCache()
+
+
+def check_safetensors(path):
+    """None if `path` is a structurally valid safetensors file, else the reason (cached)"""
+    return safetensors_verdicts.check(path)
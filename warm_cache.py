@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import List
+
+from utils.modelsConfig import CATEGORY_TO_PATH, get_config_async
+from workers.modelResolver import model_resolver, url_filename
+from workers.modelStore import ModelStore
+
+# categories warmed first to last, the rest of the config follows in file order
+WARM_CACHE_ORDER = [
+    category.strip()
+    for category in os.getenv(
+        "WARM_CACHE_ORDER", "Stable-diffusion,VAE,text_encoder,Lora,ControlNet,ESRGAN"
+    ).split(",")
+    if category.strip()
+]
+# read rate cap in MiB/s so warming doesn't starve Forge's own reads, 0 = unlimited
+WARM_CACHE_RATE_MB = float(os.getenv("WARM_CACHE_RATE_MB", "200"))
+# "read" pulls every page through the cache, "fadvise" only asks the kernel to (cheaper,
+# but network filesystems may ignore it)
+WARM_CACHE_MODE = os.getenv("WARM_CACHE_MODE", "read")
+
+CHUNK_SIZE = 16 * 1024 * 1024
+PROGRESS_LOG_INTERVAL = 10
+
+logger = logging.getLogger("warm_cache")
+logger.setLevel(logging.INFO)
+# start.sh appends stdout to forge.log, so the log viewer shows the progress
+_handler = logging.StreamHandler(sys.stdout)
+_handler.setFormatter(logging.Formatter("%(message)s"))
+logger.addHandler(_handler)
+logger.propagate = False
+
+
+class CacheWarmer(threading.Thread):
+    """
+    Reads files into the page cache in the background, one after another,
+    at most `rate` bytes per second. Progress is kept in attributes for the
+    main thread to report.
+    """
+
+    def __init__(self, files: List[Path], rate: float, mode: str):
+        super().__init__(daemon=True)
+        self.files = files
+        self.rate = rate
+        self.mode = mode
+        self.total_bytes = sum(path.stat().st_size for path in files)
+        self.done_bytes = 0
+        self.current = None
+
+    def run(self):
+        started = time.monotonic()
+        buffer = bytearray(CHUNK_SIZE)
+        for path in self.files:
+            self.current = path
+            try:
+                self._warm(path, buffer, started)
+            except OSError as e:
+                logger.warning(f"[warm-cache] Could not warm {path.name}: {e}")
+        self.current = None
+
+    def _warm(self, path, buffer, started):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            offset = 0
+            while offset < size:
+                length = min(CHUNK_SIZE, size - offset)
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+                if self.mode == "read":
+                    length = os.preadv(fd, [memoryview(buffer)[:length]], offset)
+                    if not length:
+                        break  # file got shorter while we read it
+                offset += length
+                self.done_bytes += length
+                self._throttle(started)
+        finally:
+            os.close(fd)
+
+    def _throttle(self, started):
+        if self.rate <= 0:
+            return
+        ahead = self.done_bytes / self.rate - (time.monotonic() - started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+
+def installed_path(category_path: Path, url, store: ModelStore) -> Path:
+    """
+    Where download_models.py put the model of `url`. The file name comes from the
+    source (a civitai download url ends in the version id, not the name), so look
+    it up in the model store index and the resolver cache before guessing it.
+    """
+    model = model_resolver.cached(url)
+    for candidate in {url, model.url} if model else {url}:
+        for path in store.paths_for(candidate):
+            if Path(path).parent == category_path:
+                return Path(path)
+    if model and model.filename:
+        return category_path / model.filename
+    return category_path / url_filename(url)
+
+
+def collect_files(config, base_path: Path) -> List[Path]:
+    """Installed files of the configured models, in WARM_CACHE_ORDER category order"""
+    store = ModelStore()
+    categories = [c for c in WARM_CACHE_ORDER if c in config]
+    categories += [c for c in config if c not in categories]
+
+    files = []
+    seen = set()
+    for category in categories:
+        urls = config.get(category)
+        if category not in CATEGORY_TO_PATH or not isinstance(urls, list):
+            continue
+        for url in urls:
+            path = installed_path(base_path / CATEGORY_TO_PATH[category], url, store)
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                logger.info(f"[warm-cache] Skipping {path.name}, not installed")
+                continue
+            # hardlinked copies (model store) share their pages
+            if (stat.st_dev, stat.st_ino) in seen:
+                continue
+            seen.add((stat.st_dev, stat.st_ino))
+            files.append(path)
+    return files
+
+
+def main():
+    config_path = os.getenv("MODELS_CONFIG_URL", "/workspace/models_config.json")
+    config = asyncio.run(get_config_async(config_path))
+    if not config:
+        logger.error("[warm-cache] No model configuration, nothing to warm")
+        return
+
+    base_path = Path("/workspace/stable-diffusion-webui-forge")
+    files = collect_files(config, base_path)
+    if not files:
+        logger.info("[warm-cache] No installed models to warm")
+        return
+
+    warmer = CacheWarmer(files, WARM_CACHE_RATE_MB * 1024 * 1024, WARM_CACHE_MODE)
+    gib = 1024**3
+    logger.info(
+        f"[warm-cache] Warming {len(files)} files ({warmer.total_bytes / gib:.1f} GiB, "
+        f"mode={WARM_CACHE_MODE}, limit={WARM_CACHE_RATE_MB or 'none'} MiB/s)"
+    )
+
+    started = time.monotonic()
+    warmer.start()
+    while warmer.is_alive():
+        warmer.join(PROGRESS_LOG_INTERVAL)
+        if warmer.current is not None:
+            percent = warmer.done_bytes * 100 // max(warmer.total_bytes, 1)
+            speed = warmer.done_bytes / max(time.monotonic() - started, 1e-6)
+            logger.info(
+                f"[warm-cache] {percent}% ({warmer.done_bytes / gib:.1f}/"
+                f"{warmer.total_bytes / gib:.1f} GiB) at {speed / 1024 / 1024:.0f} MiB/s, "
+                f"now {warmer.current.name}"
+            )
+
+    logger.info(
+        f"[warm-cache] Done, {warmer.done_bytes / gib:.1f} GiB warmed "
+        f"in {time.monotonic() - started:.0f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
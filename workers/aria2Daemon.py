@@ -0,0 +1,208 @@
+import asyncio
+import os
+import secrets
+import subprocess
+import time
+import uuid
+from typing import Callable, Optional
+
+import aiohttp
+
+# the daemon is shared by download_models.py and the log viewer, both talk to it on this port
+ARIA2_RPC_PORT = int(os.getenv("ARIA2_RPC_PORT", "6800"))
+# unset = a random secret per pod, shared through a 0600 file (rpc can write files anywhere)
+ARIA2_RPC_SECRET = os.getenv("ARIA2_RPC_SECRET") or None
+ARIA2_RPC_SECRET_FILE = os.getenv("ARIA2_RPC_SECRET_FILE", "/tmp/forge-aria2-rpc.secret")
+# global caps applied by the daemon to every download
+ARIA2_MAX_CONCURRENT_DOWNLOADS = int(os.getenv("ARIA2_MAX_CONCURRENT_DOWNLOADS", "3"))
+ARIA2_MAX_OVERALL_DOWNLOAD_LIMIT = os.getenv("ARIA2_MAX_OVERALL_DOWNLOAD_LIMIT", "0")
+ARIA2_MAX_CONNECTION_PER_SERVER = int(os.getenv("ARIA2_MAX_CONNECTION_PER_SERVER", "16"))
+
+DAEMON_START_TIMEOUT = 15
+
+
+class Aria2Error(Exception):
+    pass
+
+
+def pod_rpc_secret(path=ARIA2_RPC_SECRET_FILE):
+    """Random rpc secret of this pod, created by the first process that asks for it"""
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+
+    secret = secrets.token_hex(16)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "w") as f:
+        f.write(secret)
+    try:
+        # the file appears complete, when two processes race the first link wins
+        os.link(tmp_path, path)
+    except FileExistsError:
+        with open(path, "r") as f:
+            secret = f.read().strip()
+    finally:
+        os.remove(tmp_path)
+    return secret
+
+
+class Aria2Client:
+    """
+    Small JSON-RPC client for one long-lived aria2c daemon.
+
+    The daemon is started lazily by the first process that needs it (and keeps
+    running after that process exits), every download is then an `aria2.addUri`
+    call instead of a new aria2c process. Concurrency and bandwidth are capped
+    globally by the daemon options.
+    """
+
+    def __init__(self, port=ARIA2_RPC_PORT, secret=ARIA2_RPC_SECRET):
+        self.url = f"http://127.0.0.1:{port}/jsonrpc"
+        self.port = port
+        self._secret = secret
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._start_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def secret(self):
+        if self._secret is None:
+            self._secret = pod_rpc_secret()
+        return self._secret
+
+    async def call(self, method, *params):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+
+        payload = {
+            "jsonrpc": "2.0",
+            "id": uuid.uuid4().hex,
+            "method": method,
+            "params": [f"token:{self.secret}", *params],
+        }
+        async with self._session.post(self.url, json=payload) as response:
+            data = await response.json(content_type=None)
+        if "error" in data:
+            raise Aria2Error(data["error"].get("message", str(data["error"])))
+        return data["result"]
+
+    async def close(self):
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def _is_running(self):
+        try:
+            await self.call("aria2.getVersion")
+            return True
+        except (aiohttp.ClientError, asyncio.TimeoutError, OSError):
+            return False
+
+    async def ensure_daemon(self):
+        """Start the aria2c daemon unless one already answers on the rpc port"""
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+
+        async with self._start_lock:
+            if await self._is_running():
+                return
+
+            cmd = [
+                "aria2c",
+                "--enable-rpc",
+                "--rpc-listen-all=false",
+                f"--rpc-listen-port={self.port}",
+                f"--rpc-secret={self.secret}",
+                f"--max-concurrent-downloads={ARIA2_MAX_CONCURRENT_DOWNLOADS}",
+                f"--max-overall-download-limit={ARIA2_MAX_OVERALL_DOWNLOAD_LIMIT}",
+                f"--max-connection-per-server={ARIA2_MAX_CONNECTION_PER_SERVER}",
+                "--console-log-level=warn",
+                "-c",
+                "--file-allocation=none",
+                "--optimize-concurrent-downloads=true",
+                "--min-split-size=1M",
+                "--max-tries=5",
+                "--retry-wait=10",
+                "--connect-timeout=30",
+                "--timeout=600",
+            ]
+            # own session so the daemon outlives download_models.py
+            subprocess.Popen(
+                cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+
+            deadline = time.monotonic() + DAEMON_START_TIMEOUT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+                if await self._is_running():
+                    return
+            raise Aria2Error("aria2c daemon did not start")
+
+    async def download(
+        self,
+        url,
+        directory,
+        filename=None,
+        options=None,
+        on_progress: Optional[Callable[[dict], None]] = None,
+        poll_interval=1.0,
+    ):
+        """
+        Download `url` into `directory` through the daemon and wait for it.
+
+        `on_progress` gets a progress dict (bytes, speed, eta, connections) every
+        `poll_interval` seconds. Returns the final aria2 status dict, raises
+        Aria2Error when the download fails. Cancelling removes it from the daemon.
+        """
+        await self.ensure_daemon()
+
+        aria2_options = {"dir": str(directory)}
+        if filename:
+            aria2_options["out"] = filename
+        aria2_options.update({key: str(value) for key, value in (options or {}).items()})
+
+        gid = await self.call("aria2.addUri", [url], aria2_options)
+        try:
+            while True:
+                status = await self.call("aria2.tellStatus", gid)
+                if on_progress:
+                    on_progress(progress_from_status(status))
+
+                if status["status"] == "complete":
+                    return status
+                if status["status"] in ("error", "removed"):
+                    raise Aria2Error(
+                        status.get("errorMessage") or f"download {status['status']}"
+                    )
+                await asyncio.sleep(poll_interval)
+        except asyncio.CancelledError:
+            try:
+                await self.call("aria2.forceRemove", gid)
+            except Exception:
+                pass
+            raise
+
+
+def progress_from_status(status):
+    """Convert an aria2.tellStatus result into a progress dict"""
+    completed = int(status.get("completedLength", 0))
+    total = int(status.get("totalLength", 0))
+    speed = int(status.get("downloadSpeed", 0))
+    return {
+        "completed_bytes": completed,
+        "total_bytes": total,
+        "percent": int(completed * 100 / total) if total else None,
+        "speed_bytes": speed,
+        "eta_seconds": int((total - completed) / speed) if speed and total else None,
+        "connections": int(status.get("connections", 0)),
+    }
+
+
+# one client per process, the daemon itself is shared between processes
+aria2 = Aria2Client()
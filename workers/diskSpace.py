@@ -0,0 +1,238 @@
+import asyncio
+import os
+import shutil
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from workers.modelInventory import MODELS_DIR, model_inventory
+from workers.modelStore import ModelStore
+
+# kept free on the volume for Forge itself (outputs, temp files)
+DISK_HEADROOM_MB = int(os.getenv("DISK_HEADROOM_MB", "1024"))
+# max size of the models folder in GiB, 0 = only the free space counts
+MODELS_QUOTA_GB = float(os.getenv("MODELS_QUOTA_GB", "0"))
+# delete least recently used models to make room instead of rejecting a download
+EVICT_LRU_MODELS = os.getenv("EVICT_LRU_MODELS", "false").lower() == "true"
+# models read more recently than this are never evicted (Forge may have them loaded)
+EVICT_MIN_IDLE_HOURS = float(os.getenv("EVICT_MIN_IDLE_HOURS", "24"))
+# how often a download waiting for space checks again (files may be deleted by hand)
+RECHECK_INTERVAL = 10
+
+GIB = 1024**3
+
+
+class DiskSpaceError(Exception):
+    pass
+
+
+def _gib(size):
+    return f"{size / GIB:.1f} GiB"
+
+
+def _allocated(path):
+    """Bytes a file really takes (sparse/preallocated files count what's allocated)"""
+    try:
+        return os.stat(path).st_blocks * 512
+    except FileNotFoundError:
+        return 0
+
+
+def _written(path):
+    # aria2 writes the file in place, the native engine into a preallocated .part
+    return max(_allocated(path), _allocated(path + ".part"))
+
+
+def _existing_dir(path):
+    while path and not os.path.isdir(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path or "/"
+
+
+class DiskSpaceManager:
+    """
+    Admission control for downloads on a fixed size volume.
+
+    An admitted download reserves what it still has to write (its size minus
+    what is already on disk), the next one is admitted only if it fits in the
+    free space minus `headroom` and the other reservations, and under `quota`
+    for the models folder when one is set. A download that only fits once the
+    others are done waits, one that can't fit at all is rejected, unless
+    `evict` lets least recently read models be deleted to make room.
+    """
+
+    def __init__(
+        self,
+        models_dir=MODELS_DIR,
+        headroom=DISK_HEADROOM_MB * 1024 * 1024,
+        quota=int(MODELS_QUOTA_GB * GIB),
+        evict=EVICT_LRU_MODELS,
+        min_idle=EVICT_MIN_IDLE_HOURS * 3600,
+    ):
+        self.models_dir = models_dir
+        self.headroom = headroom
+        self.quota = quota
+        self.evict = evict
+        self.min_idle = min_idle
+        # key -> (path, size)
+        self._reservations: Dict[str, Tuple[str, int]] = {}
+        self._lock = asyncio.Lock()
+        self._released = asyncio.Event()
+
+    def reserved(self, exclude=None):
+        """Bytes the admitted downloads still have to write"""
+        return sum(
+            max(0, size - _written(path))
+            for key, (path, size) in list(self._reservations.items())
+            if key != exclude
+        )
+
+    def status(self):
+        usage = shutil.disk_usage(_existing_dir(self.models_dir))
+        return {
+            "total_bytes": usage.total,
+            "free_bytes": usage.free,
+            "reserved_bytes": self.reserved(),
+            "headroom_bytes": self.headroom,
+            "models_bytes": self._models_bytes() if self.quota else None,
+            "quota_bytes": self.quota or None,
+            "evict_lru": self.evict,
+        }
+
+    async def admit(
+        self,
+        key,
+        path,
+        size,
+        on_wait: Optional[Callable[[str], None]] = None,
+    ):
+        """
+        Reserve space for the download of `size` bytes to `path`.
+
+        Waits while it only fits once other downloads are done, raises
+        DiskSpaceError when it doesn't fit even then. An unknown size
+        reserves nothing.
+        """
+        if not size:
+            return
+        path = path or os.path.join(self.models_dir, key)
+        while True:
+            async with self._lock:
+                missing, missing_alone = await asyncio.to_thread(
+                    self._shortfall, key, path, size
+                )
+                if missing and self.evict:
+                    protected = {p for p, _ in self._reservations.values()} | {path}
+                    freed = await asyncio.to_thread(self._evict, missing, protected)
+                    if freed:
+                        continue
+                if not missing:
+                    self._reservations[key] = (path, size)
+                    return
+                if missing_alone or not self.reserved(exclude=key):
+                    raise DiskSpaceError(
+                        f"Not enough disk space for {os.path.basename(path)} "
+                        f"({_gib(size)}), {_gib(missing_alone or missing)} missing"
+                    )
+
+            if on_wait:
+                on_wait(
+                    f"waiting for disk space, {_gib(missing)} held by other downloads"
+                )
+            try:
+                await asyncio.wait_for(self._released.wait(), RECHECK_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, key):
+        if self._reservations.pop(key, None) is not None:
+            # wake the downloads waiting for space, they check again
+            self._released.set()
+            self._released.clear()
+
+    def _shortfall(self, key, path, size):
+        """(bytes missing now, bytes missing even without the other reservations)"""
+        needed = max(0, size - _written(path))
+        others = self.reserved(exclude=key)
+        free = shutil.disk_usage(_existing_dir(os.path.dirname(path))).free
+        missing_alone = needed - (free - self.headroom)
+        missing = missing_alone + others
+        if self.quota:
+            over_alone = self._models_bytes() + needed - self.quota
+            missing_alone = max(missing_alone, over_alone)
+            missing = max(missing, over_alone + others)
+        return max(0, missing), max(0, missing_alone)
+
+    def _models_bytes(self):
+        """Space the models folder takes, hardlinked copies counted once"""
+        seen = set()
+        total = 0
+        for path in model_inventory.model_files():
+            for candidate in (path, path + ".part"):
+                try:
+                    stat = os.stat(candidate)
+                except FileNotFoundError:
+                    continue
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    total += stat.st_blocks * 512
+        return total
+
+    def _evict(self, needed, protected):
+        """
+        Delete the least recently read models until `needed` bytes are free.
+
+        Deletes nothing (returns 0) when that isn't enough, deleting models
+        for a download that fails anyway would only lose them.
+        """
+        store = ModelStore()  # fresh index, download_models.py may have written it
+        links = {}
+        for path, state in model_inventory.model_files().items():
+            if state != "complete":
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            links.setdefault((stat.st_dev, stat.st_ino), (stat, []))[1].append(path)
+
+        now = time.time()
+        candidates = []
+        for stat, paths in links.values():
+            if protected.intersection(paths) or now - stat.st_atime < self.min_idle:
+                continue
+            sha256 = store.stored_hash(paths[0])
+            # the space only comes back once every link to the file is gone
+            if stat.st_nlink != len(paths) + (1 if sha256 else 0):
+                continue
+            candidates.append((stat.st_atime, stat.st_blocks * 512, paths, sha256))
+        candidates.sort(key=lambda candidate: candidate[0])
+
+        selected = []
+        total = 0
+        for candidate in candidates:
+            if total >= needed:
+                break
+            selected.append(candidate)
+            total += candidate[1]
+        if total < needed:
+            return 0
+
+        freed = 0
+        for _, size, paths, sha256 in selected:
+            try:
+                for path in paths:
+                    os.remove(path)
+                if sha256:
+                    store.remove(sha256)
+            except OSError as e:
+                print(f"Could not evict {paths[0]}: {e}")
+                continue
+            print(f"Evicted {', '.join(paths)} ({_gib(size)}) to make room for downloads")
+            freed += size
+        return freed
+
+
+disk_space = DiskSpaceManager()
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass, field, fields
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from constants.metrics import (
+    download_bytes,
+    download_duration,
+    download_throughput,
+    downloads_finished,
+)
+from constants.websocketEventManager import broadcast_to_websockets
+from utils.jsonFile import write_json_atomic
+from workers.diskSpace import DiskSpaceError, DiskSpaceManager
+from workers.downloadProgress import progress_tracker
+from workers.modelResolver import strip_token
+
+# where the queue is persisted so a restart of the log viewer can resume it
+JOBS_FILE = os.getenv(
+    "DOWNLOAD_JOBS_FILE", os.path.join("/workspace", ".forge_downloads", "jobs.json")
+)
+# how many downloads run at the same time, the rest wait in the queue
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", "2"))
+# finished jobs kept in the history (and the jobs file)
+MAX_FINISHED_JOBS = 100
+# api keys are never written to the jobs file, resumed civitai jobs use this one
+CIVITAI_API_KEY = os.getenv("CIVITAI_API_KEY") or None
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+
+@dataclass
+class DownloadJob:
+    source: str
+    url: str
+    model_type: str = "loras"
+    api_key: Optional[str] = None
+    filename: Optional[str] = None
+    engine: Optional[str] = None  # aria2 | native, None = DOWNLOAD_ENGINE
+    # set for jobs submitted through the batch api (see downloadPlanner)
+    batch_id: Optional[str] = None
+    size: Optional[int] = None
+    segments: Optional[int] = None
+    # target file, known before the download for the disk space check
+    path: Optional[str] = None
+    id: str = field(default_factory=lambda: uuid.uuid4().hex[:12])
+    status: str = "queued"  # queued | running | completed | failed | cancelled
+    message: Optional[str] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def public(self):
+        """Job as returned by the API (and the jobs file), without secrets"""
+        data = asdict(self)
+        data.pop("api_key")
+        data["url"] = strip_token(self.url)
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        known = {f.name for f in fields(cls)}
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+
+class DownloadJobManager:
+    """
+    Queue of model downloads with a concurrency limit.
+
+    Jobs get an id when submitted, are executed by `max_concurrent` worker tasks
+    through `runner(job)` (which returns {"success": bool, "message": str}) and
+    can be listed or cancelled. The job list is written to `jobs_file` on every
+    state change, queued and interrupted jobs are queued again on `start`.
+
+    With a `disk_space` manager a job first gets its size and target from
+    `prepare(job)`, then waits for disk space (or fails) before it runs.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[DownloadJob], Awaitable[dict]],
+        jobs_file: str = JOBS_FILE,
+        max_concurrent: int = MAX_CONCURRENT_DOWNLOADS,
+        prepare: Optional[Callable[[DownloadJob], Awaitable[None]]] = None,
+        disk_space: Optional[DiskSpaceManager] = None,
+    ):
+        self.runner = runner
+        self.prepare = prepare
+        self.disk_space = disk_space
+        self.jobs_file = jobs_file
+        self.max_concurrent = max_concurrent
+        self.jobs: Dict[str, DownloadJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._load()
+
+        for job in sorted(self.jobs.values(), key=lambda job: job.created_at):
+            if job.status == "running":
+                # interrupted by a restart, aria2c or the native engine resume the partial file
+                job.status = "queued"
+                job.message = "resumed after restart"
+            if job.status == "queued":
+                self._queue.put_nowait(job.id)
+        self._save()
+
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.max_concurrent)
+        ]
+
+    async def stop(self):
+        # running jobs stay "running" in the jobs file so the next start resumes them
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(
+        self,
+        source,
+        url,
+        model_type="loras",
+        api_key=None,
+        filename=None,
+        engine=None,
+        batch_id=None,
+        size=None,
+        segments=None,
+        path=None,
+    ):
+        job = DownloadJob(
+            source=source,
+            url=url,
+            model_type=model_type,
+            api_key=api_key,
+            filename=filename,
+            engine=engine,
+            batch_id=batch_id,
+            size=size,
+            segments=segments,
+            path=path,
+        )
+        self.jobs[job.id] = job
+        self._queue.put_nowait(job.id)
+        self._save()
+        self._notify(job)
+        return job
+
+    def list(self):
+        return sorted(self.jobs.values(), key=lambda job: job.created_at)
+
+    def get(self, job_id) -> Optional[DownloadJob]:
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id) -> Optional[DownloadJob]:
+        job = self.jobs.get(job_id)
+        if job is None or job.status in FINISHED_STATUSES:
+            return job
+
+        job.status = "cancelled"
+        job.finished_at = time.time()
+        task = self._running.get(job_id)
+        if task:
+            # removes the download from aria2c / stops the native engine (resumable)
+            task.cancel()
+        self._save()
+        self._notify(job)
+        return job
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job.status != "queued":
+                continue
+            if await self._admit(job):
+                await self._run(job)
+
+    async def _admit(self, job: DownloadJob):
+        """Wait until the job fits on disk, False when it was rejected or cancelled meanwhile"""
+        if self.disk_space is None:
+            return True
+
+        task = asyncio.create_task(self._reserve(job))
+        # cancel() stops the wait like it stops a download
+        self._running[job.id] = task
+        try:
+            await task
+            return True
+        except asyncio.CancelledError:
+            self.disk_space.release(job.id)
+            if job.status != "cancelled":
+                task.cancel()
+                raise
+            return False
+        except DiskSpaceError as e:
+            job.status = "failed"
+            job.message = str(e)
+            job.finished_at = time.time()
+            self._prune()
+            self._save()
+            self._notify(job)
+            return False
+        finally:
+            self._running.pop(job.id, None)
+
+    async def _reserve(self, job: DownloadJob):
+        if self.prepare:
+            await self.prepare(job)
+
+        waited = False
+
+        def on_wait(message):
+            nonlocal waited
+            waited = True
+            if job.message != message:
+                job.message = message
+                self._save()
+                self._notify(job)
+
+        await self.disk_space.admit(job.id, job.path, job.size, on_wait=on_wait)
+        if waited:
+            job.message = None
+
+    async def _run(self, job: DownloadJob):
+        job.status = "running"
+        job.started_at = time.time()
+        self._save()
+        self._notify(job)
+
+        task = asyncio.create_task(self.runner(job))
+        self._running[job.id] = task
+        try:
+            result = await task
+            job.status = "completed" if result.get("success") else "failed"
+            job.message = result.get("message")
+        except asyncio.CancelledError:
+            if job.status != "cancelled":
+                # the manager is shutting down, leave the job to be resumed
+                task.cancel()
+                raise
+        except Exception as e:
+            job.status = "failed"
+            job.message = str(e)
+        finally:
+            self._running.pop(job.id, None)
+            if self.disk_space:
+                self.disk_space.release(job.id)
+
+        job.finished_at = job.finished_at or time.time()
+        self._observe(job)
+        self._prune()
+        self._save()
+        self._notify(job)
+
+    def _observe(self, job: DownloadJob):
+        downloads_finished.labels(job.source, job.status).inc()
+        if job.status != "completed":
+            return
+        duration = job.finished_at - job.started_at
+        size = job.size or (progress_tracker.get(job.id) or {}).get("total_bytes")
+        download_duration.labels(job.source).observe(duration)
+        if size:
+            download_bytes.labels(job.source).observe(size)
+            if duration > 0:
+                download_throughput.labels(job.source).observe(size / duration)
+
+    def _prune(self):
+        finished = [job for job in self.list() if job.status in FINISHED_STATUSES]
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[job.id]
+            progress_tracker.clear(job.id)
+
+    def _notify(self, job: DownloadJob):
+        asyncio.create_task(
+            broadcast_to_websockets({"type": "download_job", "data": job.public()})
+        )
+
+    def _load(self):
+        try:
+            with open(self.jobs_file, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Error loading download jobs from {self.jobs_file}: {e}")
+            return
+
+        for item in data.get("jobs", []):
+            job = DownloadJob.from_dict(item)
+            if job.source == "civitai" and not job.api_key:
+                job.api_key = CIVITAI_API_KEY
+            self.jobs[job.id] = job
+
+    def _save(self):
+        try:
+            # private to the owner, the urls may still identify private models
+            write_json_atomic(
+                self.jobs_file,
+                {"jobs": [job.public() for job in self.list()]},
+                mode=0o600,
+            )
+        except Exception as e:
+            print(f"Error saving download jobs to {self.jobs_file}: {e}")
@@ -0,0 +1,202 @@
+import asyncio
+import math
+import os
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Iterable, List, Optional
+
+import aiohttp
+
+from workers.rangeDownloader import filename_from_response
+
+# cap on the connections all planned downloads open together
+MAX_TOTAL_CONNECTIONS = int(os.getenv("MAX_TOTAL_DOWNLOAD_CONNECTIONS", "16"))
+# parallel size probes while planning
+PROBE_CONCURRENCY = 8
+
+MIB = 1024 * 1024
+# (files smaller than, segments), bigger files get more connections
+SEGMENTS_BY_SIZE = (
+    (64 * MIB, 1),
+    (512 * MIB, 4),
+    (4096 * MIB, 8),
+)
+MAX_SEGMENTS = 16
+# size unknown (no Content-Length), assume a mid sized file
+DEFAULT_SEGMENTS = 4
+
+
+@dataclass
+class PlannedDownload:
+    url: str
+    directory: str
+    filename: Optional[str] = None
+    critical: bool = False
+    size: Optional[int] = None
+    # published hash (see modelResolver), same hash = same file
+    sha256: Optional[str] = None
+    segments: int = DEFAULT_SEGMENTS
+    # whatever the caller needs to run the download (category, job kwargs...)
+    payload: Any = None
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.filename) if self.filename else None
+
+
+@dataclass
+class DownloadPlan:
+    items: List[PlannedDownload]
+    # (item, reason) of everything that doesn't need downloading
+    skipped: List[tuple]
+    # (item, planned item) of the same file for another folder, linked once that one is done
+    copies: List[tuple] = field(default_factory=list)
+
+    @property
+    def total_bytes(self):
+        return sum(item.size or 0 for item in self.items)
+
+
+def segments_for_size(size):
+    if size is None:
+        return DEFAULT_SEGMENTS
+    for limit, segments in SEGMENTS_BY_SIZE:
+        if size < limit:
+            return segments
+    return MAX_SEGMENTS
+
+
+def _disposition_filename(response):
+    # only trust a name the server sent, the url path of a CDN redirect is often a hash
+    if "Content-Disposition" not in response.headers:
+        return None
+    return filename_from_response(response, response.url)
+
+
+async def probe(session, url):
+    """Return (size or None, file name or None) from a HEAD request, or a 1 byte range GET"""
+    try:
+        async with session.head(url, allow_redirects=True) as response:
+            length = response.headers.get("Content-Length")
+            if response.status < 400 and length and int(length) > 0:
+                return int(length), _disposition_filename(response)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        pass
+
+    # some hosts (signed S3 urls) refuse HEAD, the range probe works everywhere
+    try:
+        async with session.get(url, headers={"Range": "bytes=0-0"}) as response:
+            if response.status >= 400:
+                return None, None
+            filename = _disposition_filename(response)
+            total = response.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+            if response.status == 206 and total.isdigit():
+                return int(total), filename
+            length = response.headers.get("Content-Length")
+            return (int(length) if length else None), filename
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+        return None, None
+
+
+async def plan_downloads(
+    items: Iterable[PlannedDownload],
+    concurrency: int,
+    is_installed: Optional[Callable[[PlannedDownload], bool]] = None,
+    max_connections: int = MAX_TOTAL_CONNECTIONS,
+    probe_url: Optional[Callable[[PlannedDownload], str]] = None,
+) -> DownloadPlan:
+    """
+    Order a set of downloads and size their connections.
+
+    Duplicate targets are dropped, unknown sizes (and missing file names) come
+    from HEAD requests, `is_installed` filters out what's already on disk. The
+    same url/hash for another folder is downloaded once, the others are
+    returned as `copies` of it.
+    Critical items go first, then smallest first so small files don't wait
+    behind huge checkpoints. Segments grow with the file size but the
+    `concurrency` running downloads together stay under `max_connections`.
+    `probe_url(item)` gives the url to probe when it isn't `item.url` (tokens).
+    """
+    planned = []
+    skipped = []
+    targets = set()
+    for item in items:
+        if item.path and item.path in targets:
+            skipped.append((item, "duplicate"))
+            continue
+        targets.add(item.path)
+        planned.append(item)
+
+    semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+
+        async def probe_item(item):
+            if item.size is not None and item.filename:
+                return  # already resolved
+            async with semaphore:
+                url = probe_url(item) if probe_url else item.url
+                size, filename = await probe(session, url)
+            item.size = size
+            item.filename = item.filename or filename
+
+        await asyncio.gather(*(probe_item(item) for item in planned))
+
+    # the probe may have found the file name, check duplicates and installed files again
+    result = []
+    copies = []
+    targets = set()
+    # url/hash -> the planned item downloading that file
+    sources = {}
+    for item in planned:
+        if item.path and item.path in targets:
+            skipped.append((item, "duplicate"))
+            continue
+        if is_installed and is_installed(item):
+            skipped.append((item, "installed"))
+            continue
+        targets.add(item.path)
+        source = sources.get(item.url) or sources.get(item.sha256)
+        if source:
+            copies.append((item, source))
+            # the copy is only there once the source is done
+            source.critical = source.critical or item.critical
+            continue
+        for key in (item.url, item.sha256):
+            if key:
+                sources[key] = item
+        result.append(item)
+
+    per_download = max(1, max_connections // max(1, concurrency))
+    for item in result:
+        item.segments = min(segments_for_size(item.size), per_download)
+
+    result.sort(
+        key=lambda item: (
+            not item.critical,
+            item.size if item.size is not None else math.inf,
+        )
+    )
+    return DownloadPlan(result, skipped, copies)
+
+
+async def run_plan(
+    plan: DownloadPlan,
+    download: Callable[[PlannedDownload], Awaitable[bool]],
+    concurrency: int,
+) -> List[bool]:
+    """Run `download(item)` for the plan in order with at most `concurrency` at a time"""
+    results: List[bool] = [False] * len(plan.items)
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < len(plan.items):
+            index = next_index
+            next_index += 1
+            try:
+                results[index] = await download(plan.items[index])
+            except Exception:
+                results[index] = False
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return results
@@ -0,0 +1,53 @@
+import asyncio
+import os
+import time
+from typing import Dict, Optional
+
+from constants.websocketEventManager import broadcast_to_websockets
+
+# minimum seconds between two websocket progress events of the same download
+PROGRESS_INTERVAL = float(os.getenv("DOWNLOAD_PROGRESS_INTERVAL", "1"))
+
+
+class DownloadProgressTracker:
+    """
+    Last known progress of every download, keyed by job id.
+
+    `update` always records the latest numbers (queryable over HTTP) but only
+    pushes a "download_progress" websocket event every PROGRESS_INTERVAL seconds
+    per download, so a chatty downloader can't flood the clients.
+    """
+
+    def __init__(self, interval=PROGRESS_INTERVAL):
+        self.interval = interval
+        self._progress: Dict[str, dict] = {}
+        self._last_sent: Dict[str, float] = {}
+
+    def update(self, key, force=False, **progress):
+        if not key:
+            return
+
+        now = time.time()
+        entry = self._progress.setdefault(key, {"job_id": key})
+        entry.update(progress, updated_at=now)
+
+        if force or now - self._last_sent.get(key, 0) >= self.interval:
+            self._last_sent[key] = now
+            asyncio.create_task(
+                broadcast_to_websockets(
+                    {"type": "download_progress", "data": dict(entry)}
+                )
+            )
+
+    def get(self, key) -> Optional[dict]:
+        return self._progress.get(key)
+
+    def all(self):
+        return list(self._progress.values())
+
+    def clear(self, key):
+        self._progress.pop(key, None)
+        self._last_sent.pop(key, None)
+
+
+progress_tracker = DownloadProgressTracker()
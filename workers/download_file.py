@@ -1,79 +1,147 @@
 import asyncio
 import os
-import subprocess
-
-from constants.websocketEventManager import broadcast_to_websockets
 
+import aiohttp
 
-async def download_from_civitai_async(url, api_key=None, model_type="loras"):
-    """Download a model from Civitai using aria2c (async)"""
-    # Handle model_type with or without 'models/' prefix
+from constants.websocketEventManager import broadcast_to_websockets
+from utils.safetensorsHeader import check_safetensors
+from workers.aria2Daemon import aria2
+from workers.downloadPlanner import probe
+from workers.downloadProgress import progress_tracker
+from workers.googleDriveFetcher import drive_file_id, drive_resolver
+from workers.modelResolver import (
+    ResolvedModel,
+    model_resolver,
+    url_token,
+    with_query,
+)
+from workers.rangeDownloader import NATIVE_DOWNLOAD_SEGMENTS, download_with_ranges
+
+# default engine for downloads that don't pick one: "aria2" (shared daemon) or "native" (asyncio ranges)
+DOWNLOAD_ENGINE = os.getenv("DOWNLOAD_ENGINE", "aria2")
+DOWNLOAD_ENGINES = ("aria2", "native")
+
+# model_type that routes a download to the folder of its resolved type
+AUTO_MODEL_TYPE = "auto"
+AUTO_FALLBACK_MODEL_TYPE = "Lora"
+
+# per download aria2 options, global caps are set on the shared daemon
+ARIA2_DOWNLOAD_OPTIONS = {
+    "split": 16,
+    "max-connection-per-server": 16,
+    "min-split-size": "1M",
+}
+
+
+def model_dir_for(model_type):
+    """Forge folder of a model type, with or without the 'models/' prefix"""
     if model_type.startswith("models/"):
         model_path = model_type
     else:
         model_path = os.path.join("models", model_type)
+    return os.path.join("/workspace", "stable-diffusion-webui-forge", model_path)
+
+
+def civitai_download_url(url, api_key=None):
+    """Civitai download url with the api token (joined to any query the url already has)"""
+    if api_key:
+        return with_query(url, token=api_key)
+    return url
+
+
+def resolve_model_type(model_type, resolved: ResolvedModel):
+    """Forge folder for a download, "auto" takes the one the source reports"""
+    if model_type == AUTO_MODEL_TYPE:
+        return resolved.model_type or AUTO_FALLBACK_MODEL_TYPE
+    return model_type
+
+
+async def _download(
+    url,
+    model_dir,
+    filename=None,
+    job_id=None,
+    source=None,
+    engine=None,
+    segments=None,
+):
+    """Download with the selected engine, progress feeds the progress tracker"""
+
+    def on_progress(progress):
+        progress_tracker.update(job_id, source=source, **progress)
+
+    if (engine or DOWNLOAD_ENGINE) == "native":
+        path = await download_with_ranges(
+            url,
+            model_dir,
+            filename,
+            segments=segments or NATIVE_DOWNLOAD_SEGMENTS,
+            on_progress=on_progress,
+        )
+    else:
+        options = dict(ARIA2_DOWNLOAD_OPTIONS)
+        if segments:
+            # planned from the file size (see downloadPlanner)
+            options.update({"split": segments, "max-connection-per-server": segments})
+        status = await aria2.download(
+            url,
+            model_dir,
+            filename=filename,
+            options=options,
+            on_progress=on_progress,
+        )
+        path = status["files"][0]["path"]
+
+    if path.endswith(".safetensors"):
+        # a broken file is removed now instead of failing when Forge loads it
+        error = await asyncio.to_thread(check_safetensors, path)
+        if error:
+            os.remove(path)
+            raise ValueError(f"{os.path.basename(path)} is corrupted: {error}")
+    progress_tracker.update(job_id, force=True, status="completed")
+
+
+async def download_from_civitai_async(
+    url,
+    api_key=None,
+    model_type="loras",
+    job_id=None,
+    engine=None,
+    segments=None,
+    filename=None,
+):
+    """Download a model from Civitai using aria2c or the native engine (async)"""
 
     await broadcast_to_websockets(
         {"type": "download", "data": {"status": "downloading", "source": "civitai"}}
     )
 
-    model_dir = os.path.join("/workspace", "stable-diffusion-webui-forge", model_path)
-    os.makedirs(model_dir, exist_ok=True)
-
-    download_url = url
-    if api_key:
-        download_url = f"{url}?token={api_key}"
-
-    cmd = [
-        "aria2c",
-        "--console-log-level=error",
-        "-c",
-        "-x",
-        "16",
-        "-s",
-        "16",
-        "-k",
-        "1M",
-        "--file-allocation=none",
-        "--optimize-concurrent-downloads=true",
-        "--max-connection-per-server=16",
-        "--min-split-size=1M",
-        "--max-tries=5",
-        "--retry-wait=10",
-        "--connect-timeout=30",
-        "--timeout=600",
-        download_url,
-        "-d",
-        model_dir,
-    ]
-
     try:
-        # Use asyncio.create_subprocess_exec for non-blocking execution
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-        )
-        stdout, stderr = await process.communicate()
+        # file name and type from the api instead of whatever the redirect says
+        resolved = await model_resolver.resolve(url, api_key)
+        model_dir = model_dir_for(resolve_model_type(model_type, resolved))
+        os.makedirs(model_dir, exist_ok=True)
 
-        print(stdout.decode())
-        print(stderr.decode())
+        await _download(
+            civitai_download_url(resolved.url, api_key or url_token(url)),
+            model_dir,
+            filename or resolved.filename,
+            job_id=job_id,
+            source="civitai",
+            engine=engine,
+            segments=segments,
+        )
 
-        if process.returncode == 0:
-            await broadcast_to_websockets(
-                {"type": "download", "data": {"status": "success", "source": "civitai"}}
-            )
-            return {"success": True, "message": "Download completed"}
-        else:
-            await broadcast_to_websockets(
-                {
-                    "type": "download",
-                    "data": {
-                        "status": "failed",
-                        "source": "civitai",
-                        "detail": stdout.decode(),
-                    },
-                }
-            )
-            return {"success": False, "message": f"Download failed: {stdout.decode()}"}
+        await broadcast_to_websockets(
+            {"type": "download", "data": {"status": "success", "source": "civitai"}}
+        )
+        return {"success": True, "message": "Download completed"}
+    except asyncio.CancelledError:
+        # cancelled job (DELETE /api/downloads/{id}), the form must not wait forever
+        await broadcast_to_websockets(
+            {"type": "download", "data": {"status": "cancelled", "source": "civitai"}}
+        )
+        raise
     except Exception as e:
 
         await broadcast_to_websockets(
@@ -86,76 +154,43 @@ async def download_from_civitai_async(url, api_key=None, model_type="loras"):
         return {"success": False, "message": f"Error during download: {str(e)}"}
 
 
-async def download_from_huggingface_async(url, model_type="loras"):
-    """Download a model from Hugging Face using aria2c (async)"""
-    # Handle model_type with or without 'models/' prefix
-    if model_type.startswith("models/"):
-        model_path = model_type
-    else:
-        model_path = os.path.join("models", model_type)
-
-    model_dir = os.path.join("/workspace", "stable-diffusion-webui-forge", model_path)
-    os.makedirs(model_dir, exist_ok=True)
+async def download_from_huggingface_async(
+    url, model_type="loras", job_id=None, engine=None, segments=None, filename=None
+):
+    """Download a model from Hugging Face using aria2c or the native engine (async)"""
 
     await broadcast_to_websockets(
         {"type": "download", "data": {"status": "downloading", "source": "huggingface"}}
     )
 
     try:
-        filename = url.split("/")[-1]
-        cmd = [
-            "aria2c",
-            "--console-log-level=error",
-            "-c",
-            "-x",
-            "16",
-            "-s",
-            "16",
-            "-k",
-            "1M",
-            "--file-allocation=none",
-            "--optimize-concurrent-downloads=true",
-            "--max-connection-per-server=16",
-            "--min-split-size=1M",
-            "--max-tries=5",
-            "--retry-wait=10",
-            "--connect-timeout=30",
-            "--timeout=600",
+        resolved = await model_resolver.resolve(url)
+        model_dir = model_dir_for(resolve_model_type(model_type, resolved))
+        os.makedirs(model_dir, exist_ok=True)
+
+        await _download(
             url,
-            "-d",
             model_dir,
-            "-o",
-            filename,
-        ]
-
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            filename or resolved.filename,
+            job_id=job_id,
+            source="huggingface",
+            engine=engine,
+            segments=segments,
         )
-        stdout, stderr = await process.communicate()
 
-        print(stdout.decode())
-        print(stderr.decode())
-
-        if process.returncode == 0:
-            await broadcast_to_websockets(
-                {
-                    "type": "download",
-                    "data": {"status": "success", "source": "huggingface"},
-                }
-            )
-            return {"success": True, "message": "Download completed"}
-        else:
-            await broadcast_to_websockets(
-                {
-                    "type": "download",
-                    "data": {
-                        "status": "failed",
-                        "source": "huggingface",
-                        "detail": stdout.decode(),
-                    },
-                }
-            )
-            return {"success": False, "message": f"Download failed: {stdout.decode()}"}
+        await broadcast_to_websockets(
+            {
+                "type": "download",
+                "data": {"status": "success", "source": "huggingface"},
+            }
+        )
+        return {"success": True, "message": "Download completed"}
+    except asyncio.CancelledError:
+        # cancelled job (DELETE /api/downloads/{id}), the form must not wait forever
+        await broadcast_to_websockets(
+            {"type": "download", "data": {"status": "cancelled", "source": "huggingface"}}
+        )
+        raise
     except Exception as e:
 
         await broadcast_to_websockets(
@@ -169,16 +204,13 @@ async def download_from_huggingface_async(url, model_type="loras"):
 
 
 async def download_from_googledrive_async(
-    url, model_type="loras", custom_filename=None
+    url, model_type="loras", custom_filename=None, job_id=None
 ):
-    """Download a model from Google Drive using gdown (async)"""
-    # Handle model_type with or without 'models/' prefix
-    if model_type.startswith("models/"):
-        model_path = model_type
-    else:
-        model_path = os.path.join("models", model_type)
+    """Download a model from Google Drive with the native range engine (async)"""
 
-    model_dir = os.path.join("/workspace", "stable-diffusion-webui-forge", model_path)
+    # drive reports no model type, "auto" takes the fallback folder
+    resolved = ResolvedModel(source="googledrive", url=url)
+    model_dir = model_dir_for(resolve_model_type(model_type, resolved))
     os.makedirs(model_dir, exist_ok=True)
 
     await broadcast_to_websockets(
@@ -186,75 +218,37 @@ async def download_from_googledrive_async(
     )
 
     try:
-        # Extract file ID from URL if it's a full URL
-        file_id = url
-        if "drive.google.com" in url:
-            if "/file/d/" in url:
-                file_id = url.split("/file/d/")[1].split("/")[0]
-            elif "id=" in url:
-                file_id = url.split("id=")[1].split("&")[0]
-
-        # Check if gdown is installed, if not install it
-        try:
-            process = await asyncio.create_subprocess_exec(
-                "pip",
-                "show",
-                "gdown",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
+        file_id = drive_file_id(url)
+        for attempt in range(2):
+            direct_url, filename = await drive_resolver.resolve(
+                file_id, refresh=attempt > 0
             )
-            await process.communicate()
-            if process.returncode != 0:
-                raise subprocess.CalledProcessError(
-                    process.returncode, "pip show gdown"
+            try:
+                await _download(
+                    direct_url,
+                    model_dir,
+                    custom_filename or filename,
+                    job_id=job_id,
+                    source="googledrive",
+                    engine="native",
                 )
-        except:
-            process = await asyncio.create_subprocess_exec(
-                "pip",
-                "install",
-                "gdown",
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-            )
-            await process.communicate()
-
-        # Download the file
-        if custom_filename:
-            cmd = [
-                "gdown",
-                "--id",
-                file_id,
-                "-O",
-                os.path.join(model_dir, custom_filename),
-            ]
-        else:
-            cmd = ["gdown", "--id", file_id, "-O", model_dir]
+                break
+            except aiohttp.ClientResponseError:
+                # the cached url expired, resolve it again once
+                drive_resolver.invalidate(file_id)
+                if attempt:
+                    raise
 
-        process = await asyncio.create_subprocess_exec(
-            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        await broadcast_to_websockets(
+            {"type": "download", "data": {"status": "success", "source": "gdrive"}}
         )
-        stdout, stderr = await process.communicate()
-
-        print(stdout.decode())
-        print(stderr.decode())
-
-        if process.returncode == 0:
-            await broadcast_to_websockets(
-                {"type": "download", "data": {"status": "success", "source": "gdrive"}}
-            )
-            return {"success": True, "message": "Download completed"}
-        else:
-            await broadcast_to_websockets(
-                {
-                    "type": "download",
-                    "data": {
-                        "status": "failed",
-                        "source": "gdrive",
-                        "detail": stderr.decode(),
-                    },
-                }
-            )
-            return {"success": False, "message": f"Download failed: {stderr.decode()}"}
+        return {"success": True, "message": "Download completed"}
+    except asyncio.CancelledError:
+        # cancelled job (DELETE /api/downloads/{id}), the form must not wait forever
+        await broadcast_to_websockets(
+            {"type": "download", "data": {"status": "cancelled", "source": "gdrive"}}
+        )
+        raise
     except Exception as e:
 
         await broadcast_to_websockets(
@@ -265,3 +259,65 @@ async def download_from_googledrive_async(
         )
 
         return {"success": False, "message": f"Error during download: {str(e)}"}
+
+
+async def prepare_download_job(job):
+    """Fill in the size and target file of a queued job for the disk space check"""
+    if job.size and job.path:
+        return
+    try:
+        if job.source in ("civitai", "huggingface"):
+            api_key = job.api_key if job.source == "civitai" else None
+            resolved = await model_resolver.resolve(job.url, api_key)
+            model_dir = model_dir_for(resolve_model_type(job.model_type, resolved))
+            filename = job.filename or resolved.filename
+            size = resolved.size
+            url = resolved.url
+            if job.source == "civitai":
+                url = civitai_download_url(url, api_key or url_token(job.url))
+        elif job.source == "googledrive":
+            url, filename = await drive_resolver.resolve(drive_file_id(job.url))
+            resolved = ResolvedModel(source="googledrive", url=job.url)
+            model_dir = model_dir_for(resolve_model_type(job.model_type, resolved))
+            filename = job.filename or filename
+            size = None
+        else:
+            return
+
+        if size is None:
+            timeout = aiohttp.ClientTimeout(total=30)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                size, probed_filename = await probe(session, url)
+            filename = filename or probed_filename
+    except Exception as e:
+        # the download itself reports the error, it just runs without a reservation
+        print(f"Could not size download {job.url}: {e}")
+        return
+
+    job.size = job.size or size
+    if filename and not job.path:
+        job.path = os.path.join(model_dir, filename)
+
+
+async def run_download_job(job):
+    """Run a queued DownloadJob with the downloader matching its source"""
+    if job.source == "civitai":
+        return await download_from_civitai_async(
+            job.url,
+            job.api_key,
+            job.model_type,
+            job.id,
+            job.engine,
+            job.segments,
+            job.filename,
+        )
+    elif job.source == "huggingface":
+        return await download_from_huggingface_async(
+            job.url, job.model_type, job.id, job.engine, job.segments, job.filename
+        )
+    elif job.source == "googledrive":
+        return await download_from_googledrive_async(
+            job.url, job.model_type, job.filename, job.id
+        )
+
+    return {"success": False, "message": f"Unknown download source: {job.source}"}
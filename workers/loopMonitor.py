@@ -0,0 +1,122 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+
+from constants.metrics import (
+    loop_blocked,
+    loop_blocked_seconds,
+    loop_lag,
+    loop_lag_seconds,
+)
+
+# how often the event loop lag is sampled
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+# a callback holding the loop longer than this is reported with its stack
+LOOP_BLOCK_THRESHOLD = int(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "250")) / 1000
+# blocking events kept for /api/loop
+MAX_BLOCK_EVENTS = 50
+# innermost frames kept from a blocked stack
+MAX_STACK_FRAMES = 25
+
+
+class LoopWatchdog:
+    """
+    Measures the event loop lag and catches callbacks that block the loop.
+
+    A task on the loop wakes up every `interval` and records a heartbeat and
+    how late it woke up (the lag). A watchdog thread checks the heartbeat, when
+    it is older than `interval + threshold` the loop is stuck in a callback:
+    the thread grabs the loop thread's stack (sys._current_frames), logs it
+    once and keeps the event until the loop comes back with how late it was.
+    """
+
+    def __init__(self, interval=LOOP_LAG_INTERVAL, threshold=LOOP_BLOCK_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.events = deque(maxlen=MAX_BLOCK_EVENTS)
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._blocked: Optional[dict] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        with self._lock:
+            events = list(self.events)
+        return {
+            "interval_seconds": self.interval,
+            "threshold_seconds": self.threshold,
+            "lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "blocked": self._blocked is not None,
+            "events": events[::-1],
+        }
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self._beat = time.monotonic()
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            loop_lag_seconds.set(lag)
+            loop_lag.observe(lag)
+            self._unblocked(lag)
+
+    def _unblocked(self, lag):
+        with self._lock:
+            event, self._blocked = self._blocked, None
+            if event is None:
+                return
+            event["lag_seconds"] = round(lag, 3)
+        loop_blocked_seconds.observe(lag)
+        print(f"Event loop is running again, it was {lag:.2f}s late")
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            stalled = time.monotonic() - self._beat - self.interval
+            if stalled < self.threshold or self._blocked is not None:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)[-MAX_STACK_FRAMES:]
+            event = {
+                "started_at": time.time() - stalled,
+                "lag_seconds": None,  # still blocked
+                "stack": "".join(stack),
+            }
+            with self._lock:
+                self._blocked = event
+                self.events.append(event)
+            loop_blocked.inc()
+            print(
+                f"Event loop blocked for more than {stalled:.2f}s, "
+                f"loop thread stack:\n{event['stack']}"
+            )
+
+
+loop_watchdog = LoopWatchdog()
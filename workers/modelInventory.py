@@ -0,0 +1,334 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from utils.inotifyWatcher import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_ISDIR,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    IN_Q_OVERFLOW,
+    InotifyWatcher,
+    inotify_available,
+)
+from utils.jsonFile import write_json_atomic
+from workers.modelMetadata import model_metadata
+from workers.modelStore import MODEL_STORE_DIR
+
+MODELS_DIR = os.getenv(
+    "FORGE_MODELS_DIR", os.path.join("/workspace", "stable-diffusion-webui-forge", "models")
+)
+# last known inventory, loaded on start so the first request doesn't wait for the scan
+INVENTORY_FILE = os.getenv(
+    "MODEL_INVENTORY_FILE",
+    os.path.join("/workspace", ".forge_downloads", "inventory.json"),
+)
+# full rescan interval when inotify is not available (or the models dir doesn't exist yet)
+POLL_INTERVAL = 30
+# with inotify, how often the loop wakes up to check the store index and save
+INOTIFY_TIMEOUT = 1.0
+
+MODEL_EXTENSIONS = (
+    ".safetensors",
+    ".ckpt",
+    ".pt",
+    ".pth",
+    ".bin",
+    ".gguf",
+    ".sft",
+    ".onnx",
+)
+# files left next to a model while it downloads, longest first
+PARTIAL_SUFFIXES = (".part.json", ".aria2", ".part", ".link")
+
+_WATCH_MASK = IN_CLOSE_WRITE | IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO
+
+
+def _strip_partial_suffix(path):
+    for suffix in PARTIAL_SUFFIXES:
+        if path.endswith(suffix):
+            return path[: -len(suffix)]
+    return path
+
+
+class ModelInventory:
+    """
+    In-memory index of the model files actually on disk.
+
+    A background thread scans the models tree once, then keeps the index up to
+    date from inotify events (or a periodic rescan without inotify). Every file
+    has its size, mtime, download state and, from the model store index, its
+    hash status. `version` changes with every change so callers can use it as
+    an ETag.
+    """
+
+    def __init__(
+        self,
+        models_dir=MODELS_DIR,
+        inventory_file=INVENTORY_FILE,
+        store_index=os.path.join(MODEL_STORE_DIR, "index.json"),
+    ):
+        self.models_dir = models_dir
+        self.inventory_file = inventory_file
+        self.store_index = store_index
+        self.files: Dict[str, dict] = {}
+        self.version = 0
+        # boot id keeps ETags from a previous run from matching after a restart
+        self._boot = int(time.time())
+        self._lock = threading.Lock()
+        self._cache = None
+        self._dirty = False
+        self._store_mtime = None
+        self._store_hashes: Dict[str, dict] = {}
+        self._watched = set()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def etag(self):
+        return f'W/"models-{self._boot}-{self.version}"'
+
+    def start(self):
+        self._load()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def models(self):
+        """
+        Files grouped by category (first folder under models/), sorted by name.
+
+        Complete safetensors files get their header summary as "metadata", the
+        first call after a change may read headers so run it off the event loop.
+        """
+        with self._lock:
+            if self._cache and self._cache[0] == self.version:
+                return self._cache[1]
+            version = self.version
+            files = {path: dict(entry) for path, entry in self.files.items()}
+
+        # headers are read without the lock, the inotify thread and the disk
+        # space checks (model_files) don't wait for them
+        models = {}
+        for path, entry in files.items():
+            relative = os.path.relpath(path, self.models_dir)
+            category, _, name = relative.partition(os.sep)
+            if not name:
+                continue
+            item = {"name": name, "path": path, **entry}
+            item.update(self._hash_status(path, entry))
+            item["metadata"] = (
+                model_metadata.get(path, entry["size"], entry["mtime"])
+                if entry["state"] == "complete"
+                else None
+            )
+            models.setdefault(category, []).append(item)
+
+        for items in models.values():
+            items.sort(key=lambda x: x["name"].lower())
+        models = dict(sorted(models.items()))
+        with self._lock:
+            # a change meanwhile bumped the version, the next call builds again
+            self._cache = (version, models)
+        return models
+
+    def model_files(self):
+        """{path: state} of every model file, scans once when the inventory isn't running"""
+        if self._thread is None:
+            self._scan(None)
+        with self._lock:
+            return {path: entry["state"] for path, entry in self.files.items()}
+
+    def _hash_status(self, path, entry):
+        known = self._store_hashes.get(path)
+        if known and known["size"] == entry["size"]:
+            return {"hash_status": "verified", "sha256": known["sha256"], "url": known["url"]}
+        return {"hash_status": "unverified", "sha256": None, "url": None}
+
+    def _run(self):
+        watcher = None
+        if inotify_available():
+            try:
+                watcher = InotifyWatcher()
+            except OSError as e:
+                print(f"inotify unavailable, model inventory falls back to polling: {e}")
+
+        self._scan(watcher)
+        last_scan = time.monotonic()
+        while True:
+            try:
+                if watcher and self._watched:
+                    self._handle_events(watcher, watcher.read_events(INOTIFY_TIMEOUT))
+                else:
+                    time.sleep(INOTIFY_TIMEOUT)
+                    if time.monotonic() - last_scan >= POLL_INTERVAL:
+                        self._scan(watcher)
+                        last_scan = time.monotonic()
+                self._refresh_store()
+                self._save()
+            except Exception as e:
+                print(f"Error updating model inventory: {e}")
+                time.sleep(1)
+
+    def _scan(self, watcher):
+        """Walk the whole models tree and replace the index with what's on disk"""
+        files = {}
+        if watcher:
+            for wd in list(self._watched):
+                watcher.remove_watch(wd)
+            self._watched.clear()
+        for root, dirs, names in os.walk(self.models_dir):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            self._watch(watcher, root)
+            for name in names:
+                path = _strip_partial_suffix(os.path.join(root, name))
+                entry = self._stat_entry(path)
+                if entry:
+                    files[path] = entry
+
+        with self._lock:
+            if files != self.files:
+                self.files = files
+                self._changed()
+
+    def _watch(self, watcher, directory):
+        if not watcher:
+            return
+        try:
+            self._watched.add(watcher.add_watch(directory, _WATCH_MASK))
+        except OSError as e:
+            print(f"Could not watch {directory}: {e}")
+
+    def _handle_events(self, watcher, events):
+        for directory, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # the kernel dropped events, only a rescan can tell what changed
+                self._scan(watcher)
+                return
+            if directory is None or not name:
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(watcher, path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._remove_tree(path)
+            else:
+                self._refresh_file(_strip_partial_suffix(path))
+
+    def _add_tree(self, watcher, directory):
+        for root, dirs, names in os.walk(directory):
+            self._watch(watcher, root)
+            for name in names:
+                self._refresh_file(_strip_partial_suffix(os.path.join(root, name)))
+
+    def _remove_tree(self, directory):
+        prefix = directory + os.sep
+        with self._lock:
+            removed = [path for path in self.files if path.startswith(prefix)]
+            for path in removed:
+                del self.files[path]
+            if removed:
+                self._changed()
+
+    def _refresh_file(self, path):
+        entry = self._stat_entry(path)
+        with self._lock:
+            if entry == self.files.get(path):
+                return
+            if entry:
+                self.files[path] = entry
+            else:
+                self.files.pop(path, None)
+            self._changed()
+
+    def _stat_entry(self, path) -> Optional[dict]:
+        """Entry for a model file, a download in progress counts with its partial file"""
+        if not path.lower().endswith(MODEL_EXTENSIONS):
+            return None
+
+        downloading = any(
+            os.path.exists(path + suffix) for suffix in (".aria2", ".part")
+        )
+        for candidate in (path, path + ".part"):
+            try:
+                stat = os.stat(candidate)
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            return None
+
+        return {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "state": "downloading" if downloading else "complete",
+        }
+
+    def _refresh_store(self):
+        """Reload the model store index (written by download_models.py) when it changed"""
+        try:
+            mtime = os.stat(self.store_index).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._store_mtime:
+            return
+
+        hashes = {}
+        if mtime is not None:
+            try:
+                with open(self.store_index, "r") as f:
+                    data = json.load(f)
+            except Exception as e:
+                print(f"Error loading model store index {self.store_index}: {e}")
+                return
+            urls = {sha256: url for url, sha256 in data.get("urls", {}).items()}
+            for sha256, entry in data.get("objects", {}).items():
+                for path in entry.get("paths", []):
+                    hashes[path] = {
+                        "sha256": sha256,
+                        "size": entry["size"],
+                        "url": urls.get(sha256),
+                    }
+
+        with self._lock:
+            self._store_mtime = mtime
+            self._store_hashes = hashes
+            self._changed()
+
+    def _changed(self):
+        # called with the lock held
+        self.version += 1
+        self._dirty = True
+
+    def _load(self):
+        try:
+            with open(self.inventory_file, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Error loading model inventory from {self.inventory_file}: {e}")
+            return
+
+        with self._lock:
+            self.files = data.get("files", {})
+            self.version += 1
+
+    def _save(self):
+        """Persist the inventory when it changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            data = {"files": dict(self.files)}
+        try:
+            write_json_atomic(self.inventory_file, data)
+        except Exception as e:
+            print(f"Error saving model inventory to {self.inventory_file}: {e}")
+
+
+model_inventory = ModelInventory()
@@ -0,0 +1,150 @@
+import threading
+from typing import Dict, Optional
+
+from utils.safetensorsHeader import SafetensorsHeaderError, read_safetensors_header
+
+# safetensors dtype -> precision name
+PRECISIONS = {
+    "F64": "fp64",
+    "F32": "fp32",
+    "F16": "fp16",
+    "BF16": "bf16",
+    "F8_E4M3": "fp8_e4m3fn",
+    "F8_E5M2": "fp8_e5m2",
+    "I64": "int64",
+    "I32": "int32",
+    "I16": "int16",
+    "I8": "int8",
+    "U8": "uint8",
+    "BOOL": "bool",
+}
+
+# training metadata worth showing (kohya ss_* keys), modelspec.* keys are always kept
+TRAINING_METADATA_KEYS = (
+    "ss_base_model_version",
+    "ss_sd_model_name",
+    "ss_network_module",
+    "ss_network_dim",
+    "ss_network_alpha",
+    "ss_output_name",
+    "ss_resolution",
+    "ss_num_epochs",
+    "ss_num_train_images",
+    "ss_learning_rate",
+    "ss_training_comment",
+)
+
+
+def _detect_architecture(keys, metadata):
+    """Guess the base model family from the tensor names (or the trainer metadata)"""
+    spec = metadata.get("modelspec.architecture", "").lower()
+    base = metadata.get("ss_base_model_version", "").lower()
+    hint = spec or base
+    if "flux" in hint:
+        return "Flux"
+    if "xl" in hint:
+        return "SDXL"
+    if "v2" in hint or "sd2" in hint:
+        return "SD2"
+    if "v1" in hint or "sd1" in hint:
+        return "SD1.5"
+
+    joined = "\n".join(keys)
+    if "double_blocks" in joined or "single_transformer_blocks" in joined:
+        return "Flux"
+    if (
+        "conditioner.embedders.1" in joined
+        or "diffusion_model.label_emb" in joined
+        or "lora_te2_" in joined
+    ):
+        return "SDXL"
+    if "cond_stage_model.model." in joined:
+        return "SD2"
+    if (
+        "cond_stage_model.transformer" in joined
+        or "diffusion_model.input_blocks" in joined
+        or "lora_unet_" in joined
+    ):
+        return "SD1.5"
+    return None
+
+
+def _detect_kind(keys):
+    if any("lora_" in key or ".lora_A" in key or ".hada_" in key for key in keys):
+        return "lora"
+    vae_prefixes = ("encoder.", "decoder.", "quant_conv", "post_quant_conv")
+    if keys and all(key.startswith(vae_prefixes) for key in keys):
+        return "vae"
+    if any("diffusion_model." in key or "double_blocks." in key for key in keys):
+        return "checkpoint"
+    return None
+
+
+def summarize_header(header):
+    """Architecture, precision, parameter count and training metadata of a header"""
+    metadata = header.get("__metadata__") or {}
+    tensors = {key: value for key, value in header.items() if key != "__metadata__"}
+
+    params_by_dtype: Dict[str, int] = {}
+    for tensor in tensors.values():
+        count = 1
+        for dim in tensor.get("shape", []):
+            count *= dim
+        dtype = tensor.get("dtype", "?")
+        params_by_dtype[dtype] = params_by_dtype.get(dtype, 0) + count
+
+    dominant = max(params_by_dtype, key=params_by_dtype.get, default=None)
+    keys = list(tensors)
+    return {
+        "architecture": _detect_architecture(keys, metadata),
+        "kind": _detect_kind(keys),
+        "precision": PRECISIONS.get(dominant, dominant),
+        "parameters": sum(params_by_dtype.values()),
+        "tensors": len(tensors),
+        "training": {
+            key: value
+            for key, value in metadata.items()
+            if key in TRAINING_METADATA_KEYS or key.startswith("modelspec.")
+        },
+    }
+
+
+class ModelMetadataCache:
+    """
+    Header summaries of safetensors files, keyed by (path, size, mtime).
+
+    Only the JSON header is read, a changed file gets a new key and is read
+    again. Files that aren't safetensors get None.
+    """
+
+    def __init__(self):
+        self._cache: Dict[tuple, Optional[dict]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, size, mtime) -> Optional[dict]:
+        if not path.lower().endswith((".safetensors", ".sft")):
+            return None
+
+        key = (path, size, mtime)
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+
+        try:
+            header, _ = read_safetensors_header(path)
+            summary = summarize_header(header)
+        except (OSError, SafetensorsHeaderError) as e:
+            summary = {"error": str(e)}
+        except (TypeError, AttributeError, ValueError) as e:
+            # valid json but not the layout we expect (entries that aren't dicts, odd shapes)
+            summary = {"error": f"unexpected safetensors header: {e}"}
+
+        with self._lock:
+            # drop the entries of older versions of this file
+            for old_key in [k for k in self._cache if k[0] == path]:
+                del self._cache[old_key]
+            self._cache[key] = summary
+        return summary
+
+
+model_metadata = ModelMetadataCache()
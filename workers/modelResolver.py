@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import asdict, dataclass
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, unquote, urlencode, urlparse, urlunparse
+
+import aiohttp
+
+from utils.jsonFile import write_json_atomic
+
+# resolved metadata is kept this long (a civitai version never changes, a hf "main" can)
+RESOLVER_CACHE_TTL = int(os.getenv("RESOLVER_CACHE_TTL", str(24 * 3600)))
+RESOLVER_CACHE_FILE = os.getenv(
+    "RESOLVER_CACHE_FILE",
+    os.path.join("/workspace", ".forge_downloads", "resolver_cache.json"),
+)
+
+CIVITAI_API_URL = "https://civitai.com/api/v1/model-versions"
+
+# civitai model type -> Forge models/ folder
+CIVITAI_TYPE_FOLDERS = {
+    "Checkpoint": "Stable-diffusion",
+    "LORA": "Lora",
+    "LoCon": "Lora",
+    "DoRA": "Lora",
+    "VAE": "VAE",
+    "Controlnet": "ControlNet",
+    "Upscaler": "ESRGAN",
+    "TextualInversion": "embeddings",
+}
+
+_CIVITAI_VERSION_PATTERNS = (
+    re.compile(r"/api/download/models/(\d+)"),
+    re.compile(r"[?&]modelVersionId=(\d+)"),
+)
+_SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# query parameters of a civitai download url that pick one of the version's files
+_CIVITAI_FILE_SELECTORS = ("type", "format", "size", "fp")
+
+
+@dataclass
+class ResolvedModel:
+    source: str
+    # download url without credentials, add them with with_query
+    url: str
+    filename: Optional[str] = None
+    size: Optional[int] = None
+    sha256: Optional[str] = None
+    # Forge models/ folder the file belongs in, None when the source doesn't say
+    model_type: Optional[str] = None
+
+
+def with_query(url, **params):
+    """Add/replace query parameters keeping the ones already in the url, None removes one"""
+    parts = urlparse(url)
+    query = dict(parse_qsl(parts.query, keep_blank_values=True))
+    for key, value in params.items():
+        if value is None:
+            query.pop(key, None)
+        else:
+            query[key] = value
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+def url_token(url):
+    """Api token passed in the url itself (?token=...), if any"""
+    return dict(parse_qsl(urlparse(url).query)).get("token")
+
+
+def strip_token(url):
+    """Url without its ?token=, safe to log or write to disk"""
+    return with_query(url, token=None) if url_token(url) else url
+
+
+def url_filename(url):
+    """Last path segment of a url, without its query string"""
+    return os.path.basename(unquote(urlparse(url).path))
+
+
+def detect_source(url):
+    host = urlparse(url).netloc.lower()
+    if host.endswith("civitai.com"):
+        return "civitai"
+    if host.endswith("huggingface.co"):
+        return "huggingface"
+    return None
+
+
+def _civitai_file_matches(file, selectors):
+    metadata = file.get("metadata") or {}
+    for key, value in selectors.items():
+        actual = file.get("type") if key == "type" else metadata.get(key)
+        if str(actual or "").lower() != value.lower():
+            return False
+    return True
+
+
+def select_civitai_file(files, url):
+    """
+    The entry of a version's `files` that `url` downloads, None when unclear.
+
+    Without selectors civitai serves the primary file, with ?type=, ?format=,
+    ?size= or ?fp= the file matching them. Guessing wrong would hand out the
+    name and hash of another file, so an unclear match gives nothing.
+    """
+    query = dict(parse_qsl(urlparse(url).query))
+    selectors = {key: query[key] for key in _CIVITAI_FILE_SELECTORS if query.get(key)}
+    candidates = [f for f in files if _civitai_file_matches(f, selectors)]
+    if len(candidates) == 1:
+        return candidates[0]
+    primary = [f for f in candidates if f.get("primary")]
+    if len(primary) == 1:
+        return primary[0]
+    if not selectors and files:
+        return files[0]
+    return None
+
+
+class ModelResolver:
+    """
+    Asks Civitai / Hugging Face what a download url is before downloading it:
+    file name, size, sha256 and (civitai) the model type. Results are cached
+    in `cache_file` for `ttl` seconds, keyed by the url without credentials.
+    """
+
+    def __init__(self, cache_file=RESOLVER_CACHE_FILE, ttl=RESOLVER_CACHE_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._cache: Dict[str, dict] = {}
+        self._loaded = False
+
+    async def resolve(self, url, api_key=None) -> ResolvedModel:
+        """Resolve `url`, fields the source doesn't publish stay None (never raises)"""
+        api_key = api_key or url_token(url)
+        self._load()
+        key = strip_token(url)
+        cached = self._cache.get(key)
+        if cached and time.time() - cached["resolved_at"] < self.ttl:
+            return ResolvedModel(**cached["model"])
+
+        source = detect_source(url)
+        timeout = aiohttp.ClientTimeout(total=30)
+        try:
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                if source == "civitai":
+                    model = await self._resolve_civitai(session, url, api_key)
+                elif source == "huggingface":
+                    model = await self._resolve_huggingface(session, url, api_key)
+                else:
+                    model = ResolvedModel(
+                        source=source, url=url, filename=url_filename(url)
+                    )
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f"Could not resolve {url}: {e}")
+            # not cached, the next try may work
+            return ResolvedModel(
+                source=source,
+                url=url,
+                filename=None if source == "civitai" else url_filename(url),
+            )
+
+        self._cache[key] = {"resolved_at": time.time(), "model": asdict(model)}
+        self._save()
+        return model
+
+    def cached(self, url) -> Optional[ResolvedModel]:
+        """Last resolved metadata of `url` whatever its age, None if never resolved"""
+        self._load()
+        cached = self._cache.get(strip_token(url))
+        return ResolvedModel(**cached["model"]) if cached else None
+
+    async def _resolve_civitai(self, session, url, api_key):
+        version_id = None
+        for pattern in _CIVITAI_VERSION_PATTERNS:
+            match = pattern.search(url)
+            if match:
+                version_id = match.group(1)
+                break
+        if version_id is None:
+            return ResolvedModel(source="civitai", url=url)
+
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        api_url = f"{CIVITAI_API_URL}/{version_id}"
+        async with session.get(api_url, headers=headers) as response:
+            response.raise_for_status()
+            data = await response.json()
+
+        file = select_civitai_file(data.get("files") or [], url)
+        if file is None:
+            print(f"No single civitai file matches {strip_token(url)}, not checking it")
+        file = file or {}
+        sha256 = (file.get("hashes") or {}).get("SHA256", "").lower()
+        size_kb = file.get("sizeKB")
+        model_type = CIVITAI_TYPE_FOLDERS.get((data.get("model") or {}).get("type"))
+        # a checkpoint version also carries its vae, ?type=VAE downloads that one
+        file_type = file.get("type") or dict(parse_qsl(urlparse(url).query)).get("type")
+        if file_type and file_type.lower() == "vae":
+            model_type = "VAE"
+        elif file_type and file_type.lower() != "model":
+            model_type = None
+        # model page urls are turned into the download url of that version
+        download_url = with_query(url, token=None)
+        if "/api/download/models/" not in url:
+            download_url = f"https://civitai.com/api/download/models/{version_id}"
+        return ResolvedModel(
+            source="civitai",
+            url=download_url,
+            filename=file.get("name"),
+            size=int(size_kb * 1024) if size_kb else None,
+            sha256=sha256 if _SHA256_PATTERN.match(sha256) else None,
+            model_type=model_type,
+        )
+
+    async def _resolve_huggingface(self, session, url, api_key):
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        # the resolve endpoint answers with a redirect carrying the lfs size and sha256
+        async with session.head(url, headers=headers, allow_redirects=False) as response:
+            response.raise_for_status()
+            size = response.headers.get("X-Linked-Size")
+            if size is None and response.status == 200:
+                size = response.headers.get("Content-Length")
+            etag = response.headers.get("X-Linked-Etag", "").strip('"').lower()
+        return ResolvedModel(
+            source="huggingface",
+            url=url,
+            filename=url_filename(url),
+            size=int(size) if size and size.isdigit() and int(size) > 0 else None,
+            sha256=etag if _SHA256_PATTERN.match(etag) else None,
+        )
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(self.cache_file, "r") as f:
+                self._cache = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error loading resolver cache from {self.cache_file}: {e}")
+
+    def _save(self):
+        try:
+            write_json_atomic(self.cache_file, self._cache)
+        except Exception as e:
+            print(f"Error saving resolver cache to {self.cache_file}: {e}")
+
+
+model_resolver = ModelResolver()
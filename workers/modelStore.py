@@ -0,0 +1,243 @@
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+from typing import Dict, Set
+
+from utils.jsonFile import write_json_atomic
+
+# objects and index live on the same filesystem as the models so they can be hardlinked
+MODEL_STORE_DIR = os.getenv(
+    "MODEL_STORE_DIR", os.path.join("/workspace", ".model_store")
+)
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ModelStoreError(Exception):
+    pass
+
+
+def sha256_file(path):
+    """SHA-256 of a file, read in large chunks (hashlib releases the GIL)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """
+    Content-addressed store for model files.
+
+    Every verified file is kept once as objects/<sha[:2]>/<sha> and the category
+    folders get hardlinks to it, so a model used in two categories takes its
+    space once. index.json maps each hash to the object's size/mtime and the
+    paths linked to it, and each source url to its hash, so a re-run can tell
+    that a file is installed without hashing it again.
+    """
+
+    def __init__(self, root=MODEL_STORE_DIR):
+        self.root = root
+        self.index_file = os.path.join(root, "index.json")
+        self.objects: Dict[str, dict] = {}
+        self.urls: Dict[str, str] = {}
+        # changes since the last save, merged into the index file on save
+        self._changed_objects: Set[str] = set()
+        self._removed_objects: Set[str] = set()
+        self._changed_urls: Set[str] = set()
+        self._load()
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def _object_ok(self, sha256):
+        """Cheap check that the stored object wasn't touched since it was verified"""
+        entry = self.objects.get(sha256)
+        if entry is None:
+            return False
+        try:
+            stat = os.stat(self.object_path(sha256))
+        except FileNotFoundError:
+            return False
+        return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+
+    def installed(self, url, path):
+        """True when `path` is a link to the verified object downloaded from `url`"""
+        sha256 = self.urls.get(url)
+        if not sha256 or not self._object_ok(sha256):
+            return False
+        try:
+            return os.path.samefile(path, self.object_path(sha256))
+        except FileNotFoundError:
+            return False
+
+    def paths_for(self, url):
+        """Paths linked to the object downloaded from `url`"""
+        sha256 = self.urls.get(url)
+        if not sha256 or sha256 not in self.objects:
+            return []
+        return list(self.objects[sha256]["paths"])
+
+    def link_from_store(self, url, path, sha256=None):
+        """
+        Link the object downloaded from `url` to `path`, False if it isn't stored.
+        `sha256` links that object instead and records it as the one of `url`.
+        """
+        sha256 = sha256 or self.urls.get(url)
+        if not sha256 or not self._object_ok(sha256):
+            return False
+        _replace_with_link(self.object_path(sha256), str(path))
+        self._add_path(sha256, path)
+        self._set_url(url, sha256)
+        self._save()
+        return True
+
+    async def add(self, path, url=None, expected_sha256=None):
+        """
+        Hash `path`, check it against `expected_sha256` and put it in the store.
+
+        If the same content is already stored `path` is replaced by a link to
+        it. Raises ModelStoreError when the hash doesn't match, returns the hash.
+        """
+        path = str(path)
+        loop = asyncio.get_running_loop()
+        sha256 = await loop.run_in_executor(None, sha256_file, path)
+        if expected_sha256 and sha256 != expected_sha256.lower():
+            raise ModelStoreError(
+                f"{os.path.basename(path)} is corrupted: sha256 {sha256} "
+                f"does not match the published {expected_sha256.lower()}"
+            )
+
+        object_path = self.object_path(sha256)
+        try:
+            if self._object_ok(sha256):
+                if not os.path.samefile(path, object_path):
+                    # same content under another name or category, keep one copy
+                    _replace_with_link(object_path, path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                _replace_with_link(path, object_path)
+                stat = os.stat(object_path)
+                self.objects[sha256] = {
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "paths": [],
+                }
+                self._changed_objects.add(sha256)
+        except OSError as e:
+            # e.g. the store is on another filesystem, the file is fine but not deduplicated
+            print(f"Could not add {path} to the model store: {e}")
+            return sha256
+
+        self._add_path(sha256, path)
+        if url:
+            self._set_url(url, sha256)
+        self._save()
+        return sha256
+
+    def stored_hash(self, path):
+        """Hash of the stored object `path` is a link to, None if it isn't one"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        for sha256 in self.objects:
+            try:
+                if os.path.samestat(stat, os.stat(self.object_path(sha256))):
+                    return sha256
+            except FileNotFoundError:
+                continue
+        return None
+
+    def remove(self, sha256):
+        """Delete a stored object and forget it, its links are left to the caller"""
+        try:
+            os.remove(self.object_path(sha256))
+        except FileNotFoundError:
+            pass
+        self.objects.pop(sha256, None)
+        self.urls = {url: known for url, known in self.urls.items() if known != sha256}
+        self._removed_objects.add(sha256)
+        self._changed_objects.discard(sha256)
+        self._save()
+
+    def _add_path(self, sha256, path):
+        paths = self.objects[sha256]["paths"]
+        if str(path) not in paths:
+            paths.append(str(path))
+            self._changed_objects.add(sha256)
+
+    def _set_url(self, url, sha256):
+        self.urls[url] = sha256
+        self._changed_urls.add(url)
+
+    def _read(self):
+        """(objects, urls) of the index file, None when there is none"""
+        try:
+            with open(self.index_file, "r") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Error loading model store index {self.index_file}: {e}")
+            return None
+        return data.get("objects", {}), data.get("urls", {})
+
+    def _load(self):
+        index = self._read()
+        if index:
+            self.objects, self.urls = index
+
+    def _save(self):
+        """
+        Merge the changes since the last save into the index file. download_models.py
+        and the log viewer (disk space eviction) both write it from their own copy,
+        writing the whole copy would drop what the other one saved meanwhile.
+        """
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(self.index_file + ".lock", "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                objects, urls = self._read() or ({}, {})
+                for sha256 in self._removed_objects:
+                    objects.pop(sha256, None)
+                urls = {
+                    url: known
+                    for url, known in urls.items()
+                    if known not in self._removed_objects
+                }
+                for sha256 in self._changed_objects:
+                    if sha256 not in self.objects:
+                        continue
+                    entry = dict(self.objects[sha256])
+                    # links the other process added stay
+                    saved_paths = objects.get(sha256, {}).get("paths", [])
+                    entry["paths"] = saved_paths + [
+                        path for path in entry["paths"] if path not in saved_paths
+                    ]
+                    objects[sha256] = entry
+                for url in self._changed_urls:
+                    if url in self.urls:
+                        urls[url] = self.urls[url]
+                write_json_atomic(self.index_file, {"objects": objects, "urls": urls})
+        except Exception as e:
+            print(f"Error saving model store index {self.index_file}: {e}")
+            return
+        self.objects, self.urls = objects, urls
+        self._changed_objects.clear()
+        self._removed_objects.clear()
+        self._changed_urls.clear()
+
+
+def _replace_with_link(source, target):
+    """Hardlink `source` to `target`, atomically replacing whatever `target` was"""
+    tmp_target = target + ".link"
+    if os.path.lexists(tmp_target):
+        os.remove(tmp_target)
+    os.link(source, tmp_target)
+    os.replace(tmp_target, target)
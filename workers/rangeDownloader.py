@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from urllib.parse import unquote, urlparse
+
+import aiohttp
+
+from utils.jsonFile import write_json_atomic
+from workers.modelResolver import strip_token
+
+# parallel byte-range segments per file, small files get fewer (see MIN_SEGMENT_SIZE)
+NATIVE_DOWNLOAD_SEGMENTS = int(os.getenv("NATIVE_DOWNLOAD_SEGMENTS", "8"))
+MIN_SEGMENT_SIZE = 8 * 1024 * 1024
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0
+READ_CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 1.0
+# threads doing the file io of one download (preallocate, pwrite, fsync), off the event loop
+WRITER_THREADS = 4
+
+# suffixes of the partial file and of its resume state next to the target
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+
+_FILENAME_PATTERN = re.compile(
+    r"filename\*=(?:UTF-8'')?([^;]+)|filename=\"?([^\";]+)\"?", re.IGNORECASE
+)
+
+
+class RangeDownloadError(Exception):
+    pass
+
+
+def filename_from_response(response, url):
+    """Take the file name from Content-Disposition, or from the url path"""
+    disposition = response.headers.get("Content-Disposition", "")
+    match = _FILENAME_PATTERN.search(disposition)
+    if match:
+        return os.path.basename(unquote(match.group(1) or match.group(2)).strip())
+    return os.path.basename(unquote(urlparse(str(url)).path)) or "download"
+
+
+async def _probe(session, url, headers):
+    """Return (final url, size or None, supports ranges, file name) using a 1 byte range request"""
+    probe_headers = {**headers, "Range": "bytes=0-0"}
+    async with session.get(url, headers=probe_headers) as response:
+        response.raise_for_status()
+        filename = filename_from_response(response, response.url)
+        if response.status == 206:
+            content_range = response.headers.get("Content-Range", "")
+            total = content_range.rsplit("/", 1)[-1]
+            size = int(total) if total.isdigit() else None
+            return str(response.url), size, size is not None, filename
+
+        length = response.headers.get("Content-Length")
+        return str(response.url), int(length) if length else None, False, filename
+
+
+def _plan_segments(size, segments):
+    """Split [0, size) into [start, end, done] segments, end inclusive"""
+    count = max(1, min(segments, size // MIN_SEGMENT_SIZE))
+    step = size // count
+    plan = []
+    for i in range(count):
+        start = i * step
+        end = size - 1 if i == count - 1 else start + step - 1
+        plan.append([start, end, 0])
+    return plan
+
+
+def _load_state(state_path, size):
+    try:
+        with open(state_path, "r") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if state.get("size") != size:
+        return None
+    return state
+
+
+def _save_state(state_path, state):
+    write_json_atomic(state_path, state, mode=0o600)
+
+
+def _preallocate(fd, size):
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, size)
+
+
+async def _download_segment(session, url, headers, fd, segment, counter, writer):
+    """Download one [start, end, done] segment into fd at its offset, retrying with backoff"""
+    loop = asyncio.get_running_loop()
+    attempt = 0
+    while True:
+        start, end, done = segment
+        if start + done > end:
+            return
+        try:
+            range_headers = {**headers, "Range": f"bytes={start + done}-{end}"}
+            async with session.get(url, headers=range_headers) as response:
+                if response.status != 206:
+                    raise RangeDownloadError(
+                        f"server answered {response.status} to a range request"
+                    )
+                async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+                    offset = start + segment[2]
+                    # never write past the end of our segment
+                    chunk = chunk[: end - offset + 1]
+                    await loop.run_in_executor(writer, os.pwrite, fd, chunk, offset)
+                    segment[2] += len(chunk)
+                    counter[0] += len(chunk)
+                    attempt = 0
+                    if start + segment[2] > end:
+                        break
+            if start + segment[2] <= end:
+                raise RangeDownloadError("connection closed before the end of segment")
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError, RangeDownloadError) as e:
+            attempt += 1
+            if attempt > MAX_RETRIES:
+                raise RangeDownloadError(f"segment {start}-{end} failed: {e}")
+            await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+
+
+async def _download_single(session, url, headers, target_path, counter):
+    """Fallback for servers without range support: one stream, no resume"""
+    part_path = target_path + PART_SUFFIX
+    async with session.get(url, headers=headers) as response:
+        response.raise_for_status()
+        with open(part_path, "wb") as f:
+            async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+                await asyncio.to_thread(f.write, chunk)
+                counter[0] += len(chunk)
+    os.replace(part_path, target_path)
+
+
+async def download_with_ranges(
+    url,
+    directory,
+    filename=None,
+    headers=None,
+    segments=NATIVE_DOWNLOAD_SEGMENTS,
+    on_progress: Optional[Callable[[dict], None]] = None,
+):
+    """
+    Download `url` into `directory` with parallel byte-range requests (pure asyncio engine).
+
+    The target is preallocated as `<name>.part` and every segment writes at its
+    own offset. Per segment progress is saved to `<name>.part.json` so an
+    interrupted download resumes where it stopped. Failed segments are retried
+    with exponential backoff. Returns the path of the finished file.
+    """
+    headers = dict(headers or {})
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=600)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        final_url, size, ranges, probed_name = await _probe(session, url, headers)
+        target_path = os.path.join(str(directory), filename or probed_name)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+        counter = [0]
+        started = time.monotonic()
+
+        if not ranges or not size:
+
+            async def report():
+                while True:
+                    await asyncio.sleep(PROGRESS_INTERVAL)
+                    _report_progress(on_progress, counter, 0, size, started, 1)
+
+            reporter = asyncio.create_task(report())
+            try:
+                await _download_single(session, final_url, headers, target_path, counter)
+            finally:
+                reporter.cancel()
+            return target_path
+
+        part_path = target_path + PART_SUFFIX
+        state_path = target_path + STATE_SUFFIX
+        state = _load_state(state_path, size) if os.path.exists(part_path) else None
+        if state is None:
+            state = {
+                "url": strip_token(url),
+                "size": size,
+                "segments": _plan_segments(size, segments),
+            }
+
+        loop = asyncio.get_running_loop()
+        writer = ThreadPoolExecutor(WRITER_THREADS, thread_name_prefix="range-writer")
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o644)
+        tasks = []
+        try:
+            if os.fstat(fd).st_size != size:
+                # glibc emulates fallocate by writing blocks on some filesystems, slow
+                await loop.run_in_executor(writer, _preallocate, fd, size)
+            _save_state(state_path, state)
+
+            base = sum(segment[2] for segment in state["segments"])
+            pending = [
+                segment
+                for segment in state["segments"]
+                if segment[0] + segment[2] <= segment[1]
+            ]
+
+            async def save_periodically():
+                while True:
+                    await asyncio.sleep(PROGRESS_INTERVAL)
+                    _save_state(state_path, state)
+                    _report_progress(
+                        on_progress, counter, base, size, started, len(pending)
+                    )
+
+            saver = asyncio.create_task(save_periodically())
+            tasks = [
+                asyncio.create_task(
+                    _download_segment(
+                        session, final_url, headers, fd, segment, counter, writer
+                    )
+                )
+                for segment in pending
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                saver.cancel()
+                _save_state(state_path, state)
+
+            await loop.run_in_executor(writer, os.fsync, fd)
+        finally:
+            # one failed segment must not leave the others writing into a closed
+            # (and maybe already reused) fd: stop them, then wait for queued writes
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.to_thread(writer.shutdown, True)
+            os.close(fd)
+
+    _report_progress(on_progress, counter, base, size, started, 0)
+    os.replace(part_path, target_path)
+    os.remove(state_path)
+    return target_path
+
+
+def _report_progress(on_progress, counter, base, size, started, connections):
+    if not on_progress:
+        return
+    completed = base + counter[0]
+    elapsed = max(time.monotonic() - started, 1e-6)
+    speed = int(counter[0] / elapsed)
+    on_progress(
+        {
+            "completed_bytes": completed,
+            "total_bytes": size or 0,
+            "percent": int(completed * 100 / size) if size else None,
+            "speed_bytes": speed,
+            "eta_seconds": int((size - completed) / speed) if speed and size else None,
+            "connections": connections,
+        }
+    )
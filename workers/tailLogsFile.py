@@ -1,10 +1,131 @@
-import asyncio
 import os
 import time
 
-from constants.logLock import log_buffer, log_lock
-from constants.websocketEventManager import sync_broadcast_to_websockets
-from utils.formatLogLine import format_log_line
+from constants.logLock import log_buffer
+from constants.metrics import log_lines_read, log_tail_lag_bytes, log_tail_lag_seconds
+from constants.websocketEventManager import hub
+from utils.formatLogLine import parse_log_line, render_log_record
+from utils.inotifyWatcher import (
+    IN_CLOSE_WRITE,
+    IN_CREATE,
+    IN_DELETE,
+    IN_MODIFY,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    InotifyWatcher,
+    inotify_available,
+)
+
+# polling interval used when inotify is not available
+POLL_INTERVAL = 0.1
+# with inotify we still re-check the file once in a while in case an event was missed
+INOTIFY_TIMEOUT = 1.0
+READ_CHUNK_SIZE = 256 * 1024
+
+
+def follow(file_path):
+    """
+    Generator that yields new lines appended to a file.
+
+    Uses inotify on the parent directory when available (falls back to polling),
+    reads only the appended bytes by tracking the byte offset, and handles rotation
+    (inode change) and truncation (size smaller than our offset).
+    """
+    watcher = None
+    if inotify_available():
+        try:
+            watcher = InotifyWatcher()
+            watcher.add_watch(
+                os.path.dirname(file_path),
+                IN_MODIFY
+                | IN_CLOSE_WRITE
+                | IN_CREATE
+                | IN_DELETE
+                | IN_MOVED_FROM
+                | IN_MOVED_TO,
+            )
+        except OSError as e:
+            print(f"inotify unavailable, falling back to polling: {e}")
+            if watcher:
+                watcher.close()
+            watcher = None
+
+    def wait_for_change():
+        if watcher:
+            watcher.read_events(timeout=INOTIFY_TIMEOUT)
+        else:
+            time.sleep(POLL_INTERVAL)
+
+    fd = None
+    inode = None
+    offset = 0
+    pending = b""
+
+    def read_appended():
+        """Read every byte appended after `offset` and return the complete lines"""
+        nonlocal offset, pending
+        lines = []
+        while True:
+            data = os.pread(fd, READ_CHUNK_SIZE, offset)
+            if not data:
+                break
+            offset += len(data)
+            pending += data
+            *complete, pending = pending.split(b"\n")
+            lines.extend(complete)
+        if lines:
+            # once per read, not per line
+            stat = os.fstat(fd)
+            log_lines_read.inc(len(lines))
+            log_tail_lag_seconds.set(max(0.0, time.time() - stat.st_mtime))
+            log_tail_lag_bytes.set(max(0, stat.st_size - offset))
+        return [line.decode("utf-8", errors="replace") for line in lines]
+
+    try:
+        while True:
+            try:
+                if fd is None:
+                    try:
+                        fd = os.open(file_path, os.O_RDONLY)
+                    except FileNotFoundError:
+                        wait_for_change()
+                        continue
+                    inode = os.fstat(fd).st_ino
+                    offset = 0
+                    pending = b""
+
+                try:
+                    current_inode = os.stat(file_path).st_ino
+                except FileNotFoundError:
+                    current_inode = None
+
+                if current_inode != inode:
+                    # File was rotated/replaced: drain the old one, then reopen the new path
+                    yield from read_appended()
+                    if pending:
+                        yield pending.decode("utf-8", errors="replace")
+                    os.close(fd)
+                    fd = None
+                    continue
+
+                if os.fstat(fd).st_size < offset:
+                    # File was truncated, start from beginning
+                    offset = 0
+                    pending = b""
+
+                new_lines = read_appended()
+                if new_lines:
+                    yield from new_lines
+                else:
+                    wait_for_change()
+            except Exception as e:
+                print(f"Error following log file: {e}")
+                time.sleep(1)  # Wait a bit longer on error
+    finally:
+        if fd is not None:
+            os.close(fd)
+        if watcher:
+            watcher.close()
 
 
 def tail_log_file():
@@ -12,60 +133,24 @@ def tail_log_file():
     log_file = os.path.join("/", "workspace", "logs", "forge.log")
 
     if not os.path.exists(log_file):
-        os.makedirs("/","workspace","logs", exist_ok=True)
+        os.makedirs(os.path.dirname(log_file), exist_ok=True)
         open(log_file, "a").close()
 
-    def follow(file_path):
-        """Generator function that yields new lines in a file with proper handling of file rotation/truncation"""
-        with open(file_path, "r", encoding="utf-8") as file:
-            current_position = 0
-            while True:
-                try:
-                    # Check if file has been truncated
-                    file_size = os.path.getsize(file_path)
-                    if file_size < current_position:
-                        current_position = 0  # File was truncated, start from beginning
-
-                    # Seek to last position
-                    file.seek(current_position)
-
-                    # Read new lines
-                    new_lines = file.readlines()
-                    if new_lines:
-                        current_position = file.tell()
-                        for line in new_lines:
-                            yield line
-                    else:
-                        # No new lines, sleep before checking again
-                        time.sleep(0.1)
-                except Exception as e:
-                    print(f"Error following log file: {e}")
-                    time.sleep(1)  # Wait a bit longer on error
-
     try:
         # Start the continuous tail
         prev_line = None
         for line in follow(log_file):
             stripped_line = line.strip()
-            if stripped_line:  # Only process non-empty lines and not duplicates
-                with log_lock:
-                    log_buffer.append(stripped_line)
-                    if len(log_buffer) > 500:
-                        log_buffer.pop(0)
-
-                # Emit new log line via WebSocket (thread-safe)
-                sync_broadcast_to_websockets(
-                    {
-                        "type": "new_log_line",
-                        "line": format_log_line(stripped_line, ws=True),
-                    }
-                )
+            # Only process non-empty lines and not duplicates
+            if stripped_line and stripped_line != prev_line:
+                # parse once at ingest, /logs and the websocket both render from this record
+                record = parse_log_line(stripped_line)
+                seq = log_buffer.append(record)
+
+                # Emit new log line via WebSocket (thread-safe, batched by the hub)
+                hub.publish_log_line(render_log_record(record, ws=True), seq)
             prev_line = stripped_line
     except Exception as e:
         print(f"Error tailing log file: {e}")
         time.sleep(5)
 
-
-def tlf_worker(tail_log_file, loop):
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(tail_log_file())
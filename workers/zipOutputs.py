@@ -0,0 +1,276 @@
+import asyncio
+import fnmatch
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+from constants.logLock import thread_executor
+from constants.metrics import zip_export_bytes, zip_export_seconds
+
+OUTPUT_DIR = os.path.join("/workspace", "stable-diffusion-webui-forge", "outputs")
+
+# size of the chunks handed to the response, and how many may wait in memory
+CHUNK_SIZE = 1024 * 1024
+MAX_PENDING_CHUNKS = 8
+# a reader waiting for the next chunk wakes up this often to check the writer is alive
+CHUNK_WAIT_TIMEOUT = 1.0
+
+# deflate level (0-9) for files that are worth compressing (text, json, metadata...)
+COMPRESS_LEVEL = int(os.getenv("OUTPUT_ZIP_COMPRESSLEVEL", "6"))
+
+# formats that are already compressed, deflating them burns cpu for almost no size gain
+STORED_EXTENSIONS = {
+    ".png",
+    ".jpg",
+    ".jpeg",
+    ".webp",
+    ".gif",
+    ".avif",
+    ".mp4",
+    ".webm",
+    ".zip",
+    ".gz",
+    ".7z",
+}
+
+# name of the manifest entry appended at the end of every export
+MANIFEST_NAME = "manifest.json"
+
+_DONE = object()
+
+
+class _ExportCancelled(Exception):
+    pass
+
+
+class _ChunkWriter:
+    """
+    Write-only, unseekable sink for zipfile.
+
+    zipfile falls back to data descriptors when it can't seek, so entries are
+    written sequentially and every CHUNK_SIZE bytes are handed to `put`.
+    """
+
+    def __init__(self, put):
+        self._put = put
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        if len(self._buffer) >= CHUNK_SIZE:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+
+def compression_for(file_name, store_compressed=True):
+    """Pick the zip compression method for a file: store images/archives, deflate the rest"""
+    if store_compressed and os.path.splitext(file_name)[1].lower() in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def parse_since(value):
+    """Parse a `since` filter given as unix timestamp or ISO 8601 date, raise ValueError otherwise"""
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def collect_output_files(output_dir=OUTPUT_DIR, since=None, subdirs=None, patterns=None):
+    """
+    Walk the outputs folder and return the files to export as dicts (path, arcname, size, mtime).
+
+    `since` keeps files modified after that unix timestamp, `subdirs` limits the walk
+    to those folders (e.g. txt2img-images, txt2img-images/2024-01-01) and `patterns`
+    are globs matched against the relative path or the file name.
+    """
+    root_dir = os.path.realpath(output_dir)
+    roots = [root_dir]
+    if subdirs:
+        roots = []
+        for subdir in subdirs:
+            path = os.path.realpath(os.path.join(root_dir, subdir))
+            if path != root_dir and not path.startswith(root_dir + os.sep):
+                raise ValueError(f"subdir outside of outputs: {subdir}")
+            roots.append(path)
+
+    seen = set()
+    files = []
+    for walk_root in roots:
+        for root, dirs, names in os.walk(walk_root):
+            dirs.sort()
+            for name in sorted(names):
+                file_path = os.path.join(root, name)
+                if file_path in seen:
+                    continue
+                seen.add(file_path)
+
+                arcname = os.path.relpath(file_path, root_dir).replace(os.sep, "/")
+                if patterns and not any(
+                    fnmatch.fnmatch(arcname, pattern) or fnmatch.fnmatch(name, pattern)
+                    for pattern in patterns
+                ):
+                    continue
+
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                if since is not None and stat.st_mtime <= since:
+                    continue
+
+                files.append(
+                    {
+                        "path": file_path,
+                        "arcname": arcname,
+                        "size": stat.st_size,
+                        "mtime": stat.st_mtime,
+                    }
+                )
+    return files
+
+
+def build_manifest(files, next_since, filters=None):
+    """Manifest describing an export, the client passes `next_since` back as `since` next time"""
+    return {
+        "generated_at": time.time(),
+        "next_since": next_since,
+        "filters": filters or {},
+        "total_files": len(files),
+        "total_bytes": sum(file["size"] for file in files),
+        "files": [
+            {"path": file["arcname"], "size": file["size"], "mtime": file["mtime"]}
+            for file in files
+        ],
+    }
+
+
+def _write_zip(files, manifest, chunks, cancelled, compresslevel, store_compressed):
+    """Write `files` (and the manifest) as an archive into the `chunks` queue (runs in its own thread)"""
+    def put(item):
+        # block while the client is slower than us, but give up once the response is gone
+        while True:
+            if cancelled.is_set():
+                raise _ExportCancelled()
+            try:
+                chunks.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                pass
+
+    try:
+        sink = _ChunkWriter(put)
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+            for file in files:
+                try:
+                    zf.write(
+                        file["path"],
+                        file["arcname"],
+                        compress_type=compression_for(file["arcname"], store_compressed),
+                        compresslevel=compresslevel,
+                    )
+                except FileNotFoundError:
+                    # deleted between the walk and now
+                    continue
+            if manifest is not None:
+                zf.writestr(
+                    MANIFEST_NAME,
+                    json.dumps(manifest, indent=2),
+                    compress_type=zipfile.ZIP_DEFLATED,
+                    compresslevel=compresslevel,
+                )
+        sink.close()
+    except _ExportCancelled:
+        pass
+    except Exception as e:
+        print(f"Error creating output zip: {e}")
+        try:
+            put(e)
+        except _ExportCancelled:
+            pass
+    finally:
+        try:
+            put(_DONE)
+        except _ExportCancelled:
+            # release a reader that may still be waiting on the queue
+            try:
+                chunks.put_nowait(_DONE)
+            except queue.Full:
+                pass
+
+
+async def stream_output_zip(
+    output_dir=OUTPUT_DIR,
+    compresslevel=COMPRESS_LEVEL,
+    store_compressed=True,
+    files=None,
+    manifest=None,
+):
+    """
+    Async generator yielding a zip chunk by chunk.
+
+    Exports `files` (from collect_output_files) or everything under `output_dir`,
+    plus `manifest` as manifest.json when given. The file reads and compression
+    run in a thread of their own, at most MAX_PENDING_CHUNKS chunks are buffered so
+    memory stays flat whatever the size of the outputs folder. Already compressed
+    files are stored unless `store_compressed` is False.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = queue.Queue(maxsize=MAX_PENDING_CHUNKS)
+    cancelled = threading.Event()
+
+    if files is None:
+        files = await loop.run_in_executor(
+            thread_executor, collect_output_files, output_dir
+        )
+
+    # its own thread: it lives as long as the (client paced) response, a pool worker
+    # held that long would starve the other endpoints using thread_executor
+    writer = threading.Thread(
+        target=_write_zip,
+        args=(files, manifest, chunks, cancelled, compresslevel, store_compressed),
+        name="zip-export",
+        daemon=True,
+    )
+    writer.start()
+
+    started = time.perf_counter()
+    sent = 0
+    try:
+        while True:
+            try:
+                chunk = await loop.run_in_executor(
+                    None, functools.partial(chunks.get, timeout=CHUNK_WAIT_TIMEOUT)
+                )
+            except queue.Empty:
+                if not writer.is_alive() and chunks.empty():
+                    raise RuntimeError("zip writer stopped without finishing the export")
+                continue
+            if chunk is _DONE:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            sent += len(chunk)
+            yield chunk
+        zip_export_seconds.observe(time.perf_counter() - started)
+        zip_export_bytes.observe(sent)
+    finally:
+        # client went away (or we are done): stop the writer thread
+        cancelled.set()